@@ -4,900 +4,953 @@
 """
 
 import os
-import re
+import sys
+import argparse
+import fnmatch
 import traceback
 import configparser
+import hashlib
+import io
+import json
+import posixpath
+import shutil
+import sqlite3
+import tempfile
+import time
 import threading
-import subprocess  # 用于非Windows系统打开文件
+import queue
+import multiprocessing
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from datetime import datetime
-from tkinter import (
-    Tk, Frame, Button, Label, StringVar, Radiobutton, messagebox, filedialog, END, Toplevel,
-    DoubleVar
-)
-from tkinter import ttk
-import pdfplumber
 import pandas as pd
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font
+from invoice_parser import (
+    ARCHIVE_SEP, PARSER_VERSION, parse_invoice_file_timed, set_known_invoices,
+)
+from invoice_perf import PerfReport, collect_timings, merge_timings, stage
+# 界面在 invoice_gui 中，导出模块（openpyxl）只在导出时导入：Windows 上进程池以 spawn 方式启动子进程，
+# 子进程会重新导入本模块，顶层只保留解析需要的模块；无图形环境的服务器上也可以使用命令行模式
 
 CONFIG_FILE = 'invoice_config.ini'
-UNIT_KEYWORDS = [
-    '千克', '个', '件', '套', '台', '张', '米', '公斤', '升', '吨',
-    '箱', '盒', '包', '瓶', '罐', '条', '只', '卷', '桶', '大', '袋',
-    '块', '次', '批', '批次', '项',
-    '枚', '支', '根', '头', '辆', '架', '艘', '本', '册', '部',
-    '组', '副', '双', '对', '厘米', '毫米', '公里', '英尺', '英寸',
-    '平方米', '平方英尺', '立方米', '立方厘米', '加仑', '毫升',
-    '克', '毫克', '磅', '盎司', '小时', '天', '月', '年', '季度',
-    '份', '页', '场', '位', '人次', '立方', '平米', '度', '千瓦时', '斤', '两',
-    '㎡', 'm³', '㎏', '㎞', '千米', '公里', '克'
-]
-
-class InvoiceApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Invoice2EXCEL V4.2")
-        self.config = configparser.ConfigParser()
-        self.load_config()
-
-        # 固定窗口大小为 1139x837
-        fixed_width = 1139
-        fixed_height = 837
-        self.root.geometry(f"{fixed_width}x{fixed_height}")
+CACHE_FILE = 'invoice_cache.db'
+INDEX_FILE = 'invoice_index.db'
+# 解析状态对应的列表显示文字
+STATUS_TEXT = {'duplicate': "已添加过", 'exported': "已导出过", 'not_invoice': "非发票", 'error': "错误"}
+# 明细落盘后内存中保留的最近使用发票数
+DETAIL_HOT_FRAMES = 16
+# 解析缓存超出容量时一次淘汰到容量的这一比例以下
+CACHE_EVICT_RATIO = 0.9
+# 监控文件夹的默认扫描间隔（秒）
+WATCH_INTERVAL = 30
+# 配置中多个文件夹、多个文件名模式之间用 | 分隔
+CONFIG_LIST_SEP = '|'
+# 默认导入的发票格式：PDF、OFD、全电发票XML，以及装有这些文件的ZIP包
+DEFAULT_INCLUDE = ('*.pdf', '*.ofd', '*.xml', '*.zip')
+# 枚举文件夹时最多领先解析多少个文件；每个解析进程最多排队的文件数
+DISCOVERY_QUEUE_SIZE = 1000
+IN_FLIGHT_PER_WORKER = 4
+
+
+def file_digest(path):
+    """文件内容的 SHA-256，用作解析缓存键和重复文件判断"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def matches_patterns(name, rel_path, patterns):
+    return any(fnmatch.fnmatchcase(name, p) or fnmatch.fnmatchcase(rel_path, p) for p in patterns)
+
+
+def iter_pdf_files(folder, include=DEFAULT_INCLUDE, exclude=()):
+    """用 os.scandir 递归遍历文件夹，边遍历边产出匹配的文件路径（同一文件夹内按名称排序）
+
+    include/exclude 为不区分大小写的通配符模式，同时与文件名和相对路径（/ 分隔）比较；
+    被 exclude 匹配的子文件夹整体跳过。跟随目录符号链接时按 (设备号, inode) 去重，避免循环。
+    """
+    include = [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+    seen = set()
+    stack = [(folder, '')]
+    while stack:
+        current, rel_dir = stack.pop()
+        try:
+            st = os.stat(current)
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            name = entry.name.lower()
+            rel_path = rel_dir + name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if matches_patterns(name, rel_path, exclude):
+                continue
+            if is_dir:
+                subdirs.append((entry.path, rel_path + '/'))
+            elif matches_patterns(name, rel_path, include):
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+
+def is_archive(path):
+    return isinstance(path, str) and path.lower().endswith('.zip')
 
-        # 禁止调整窗口大小
-        self.root.resizable(False, False)
 
-        # 恢复上次窗口位置
-        try:
-            geom = self.config.get('window', 'position', fallback=None)
-            if geom:
-                if '+' in geom:
-                    pos_part = geom
-                    if '+' in pos_part[1:]:
-                        x, y = pos_part.split('+', 2)[1:]
-                        if x.lstrip('-').isdigit() and y.lstrip('-').isdigit():
-                            self.root.geometry(f"+{x}+{y}")
-        except:
-            pass
+def archive_root(path):
+    """压缩包成员所在的磁盘文件路径，普通文件原样返回"""
+    return path.split(ARCHIVE_SEP, 1)[0]
 
-        # 修改默认保存路径为当前登录用户的桌面（兼容所有用户）
-        self.save_path = self.config.get('settings', 'save_path', fallback=os.path.join(os.path.expanduser("~"), "Desktop"))
 
-        self.invoices = []
-        self.export_mode = StringVar(value=self.config.get('settings', 'export_mode', fallback="merge"))
-        self.all_var = StringVar(value=self.config.get('settings', 'all_selected', fallback="1"))
-        self.loading_dialog = None
-        self.progress_var = None
-        self.progress_label = None
-        self.build_ui()
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.tree.bind('<Button-1>', self.on_check_click)
-        self.tree.tag_configure('success', background='#e6f3ff')
-        self.root.update_idletasks()
-        self.root.after(100, self.force_column_widths)
-
-    def force_column_widths(self):
-        self.tree.column('check', width=60)
-        self.tree.column('num', width=80)
-        self.tree.column('file', width=800)
-        self.tree.column('rows', width=150)
-        self.root.update_idletasks()
+def display_name(path):
+    """列表中显示的文件名；压缩包成员显示为“压缩包名::成员文件名”"""
+    parts = path.split(ARCHIVE_SEP)
+    return ARCHIVE_SEP.join([os.path.basename(parts[0])] + [posixpath.basename(p) for p in parts[1:]])
+
+
+class ArchiveMember:
+    """ZIP包中的一个发票文件，不解压到磁盘：chain 为 (磁盘上的压缩包路径, 嵌套压缩包成员名…, 发票成员名)，
+    path 为各段以 ARCHIVE_SEP 相连的“压缩包路径::成员名”；只记录位置，内容由 ArchiveReader 读取时才打开"""
+    __slots__ = ('path', 'chain')
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.path = ARCHIVE_SEP.join(chain)
+
+
+def open_archive_chain(chain):
+    """依次打开压缩包链：第一个为磁盘上的ZIP，之后每个为上一层中的嵌套ZIP（读入内存），返回打开的 ZipFile 列表"""
+    zips = [zipfile.ZipFile(chain[0])]
+    try:
+        for name in chain[1:]:
+            zips.append(zipfile.ZipFile(io.BytesIO(zips[-1].read(name))))
+    except BaseException:
+        close_archives(zips)
+        raise
+    return zips
+
+
+def close_archives(zips):
+    for zf in reversed(zips):
+        zf.close()
+
+
+class ArchiveReader:
+    """读取压缩包成员：同一压缩包的连续成员共用打开的压缩包链，换到其他压缩包或读取结束时关闭，
+    不会长期占用压缩包文件（Windows 上打开的文件不能删除或移动），内存中最多只有当前一层嵌套ZIP的内容"""
+
+    def __init__(self):
+        self.chain = None
+        self.zips = []
+
+    def read(self, member):
+        container = member.chain[:-1]
+        if container != self.chain:
+            self.close()
+            self.zips = open_archive_chain(container)
+            self.chain = container
+        return self.zips[-1].read(member.chain[-1])
+
+    def close(self):
+        close_archives(self.zips)
+        self.zips = []
+        self.chain = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def archive_infos(chain):
+    """列出压缩包链最内层压缩包的成员信息，列完即关闭"""
+    zips = open_archive_chain(chain)
+    try:
+        return zips[-1].infolist()
+    finally:
+        close_archives(zips)
+
+
+def iter_archive(chain, include, exclude):
+    """按包内顺序逐个产出压缩包链中匹配的成员，不写临时文件
+
+    只读取ZIP的目录；嵌套的ZIP在遍历到时才打开、列出其成员，列完即释放，不会预先读入全部内容。
+    """
+    try:
+        infos = archive_infos(chain)
+    except Exception as e:
+        print(f"无法打开压缩包 {ARCHIVE_SEP.join(chain)}: {e}")
+        return
+    for info in infos:
+        if info.is_dir():
+            continue
+        rel_path = info.filename.lower()
+        name = posixpath.basename(rel_path)
+        if matches_patterns(name, rel_path, exclude):
+            continue
+        if is_archive(name):
+            yield from iter_archive(chain + (info.filename,), include, exclude)
+        elif matches_patterns(name, rel_path, include):
+            yield ArchiveMember(chain + (info.filename,))
+
+
+def iter_sources(files, include=DEFAULT_INCLUDE, exclude=()):
+    """展开文件列表中的ZIP包：普通文件原样产出，包中的发票逐个产出 ArchiveMember
+
+    压缩包只在列出成员时短暂打开，边枚举边导入时也不会一直占用压缩包文件。
+    """
+    include = [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+    for path in files:
+        if is_archive(path):
+            yield from iter_archive((path,), include, exclude)
+        else:
+            yield path
+
 
-    def load_config(self):
-        if os.path.exists(CONFIG_FILE):
+def read_source(source, reader):
+    """返回 (交给解析的对象, 内容哈希)：普通文件为路径，压缩包成员用 reader 读入内存；读取失败时均为 None"""
+    if isinstance(source, ArchiveMember):
+        try:
+            data = reader.read(source)
+        except Exception:
+            traceback.print_exc()
+            return None, None
+        return data, hashlib.sha256(data).hexdigest()
+    try:
+        return source, file_digest(source)
+    except OSError:
+        return source, None
+
+
+class FileDiscovery:
+    """在后台线程中枚举文件，经有界队列交给解析，解析不必等整棵目录树遍历完
+
+    队列满时枚举线程等待；found 为已发现的文件数，finished 表示枚举已结束。
+    """
+    END = object()
+
+    def __init__(self, files, maxsize=DISCOVERY_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.found = 0
+        self.finished = False
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, args=(files,), daemon=True).start()
+
+    def put(self, item):
+        while not self.stopped.is_set():
             try:
-                self.config.read(CONFIG_FILE, encoding='utf-8')
-            except:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
                 pass
+        return False
 
-    def save_config(self):
+    def run(self, files):
         try:
-            if 'settings' not in self.config:
-                self.config.add_section('settings')
-            if 'window' not in self.config:
-                self.config.add_section('window')
-
-            self.config['settings']['save_path'] = self.save_path
-            self.config['settings']['export_mode'] = self.export_mode.get()
-            self.config['settings']['all_selected'] = self.all_var.get()
-
-            # 保存窗口位置
-            current_geom = self.root.geometry()
-            if '+' in current_geom:
-                pos_part = '+' + current_geom.split('+', 1)[1]
-                self.config['window']['position'] = pos_part
-
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                self.config.write(f)
-        except Exception as e:
-            print(f"保存配置失败: {e}")
-
-    def on_closing(self):
-        self.save_config()
-        self.root.destroy()
-
-    def build_ui(self):
-        top_frame = Frame(self.root, bg='#f0f0f0', pady=10)
-        top_frame.pack(fill='x', padx=10, pady=5)
-
-        btn_width = 12
-        Button(top_frame, text="添加发票", command=self.add_files, width=btn_width, height=1,
-               font=('微软雅黑', 10), bg='#4a90e2', fg='white').pack(side='left', padx=5)
-        Button(top_frame, text="添加文件夹", command=self.add_folder, width=btn_width, height=1,
-               font=('微软雅黑', 10), bg='#4a90e2', fg='white').pack(side='left', padx=5)
-        Label(top_frame, text="支持多选、多页电子发票PDF文件", font=('微软雅黑', 10), bg='#f0f0f0').pack(side='left', padx=10)
-
-        mid_frame = Frame(self.root)
-        mid_frame.pack(fill='both', expand=True, padx=10, pady=(0, 5))
-
-        header_frame = Frame(mid_frame)
-        header_frame.pack(fill='x')
-        Label(header_frame, text="已添加的发票列表",
-              font=('微软雅黑', 9)).pack(anchor='w', padx=5)
-
-        tree_container = Frame(mid_frame)
-        tree_container.pack(fill='both', expand=True)
-
-        columns = ('check', 'num', 'file', 'rows')
-        self.tree = ttk.Treeview(tree_container, columns=columns, show='headings', selectmode='extended')
-
-        vsb = ttk.Scrollbar(tree_container, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=vsb.set)
-
-        self.tree.heading('check', text='✓')
-        self.tree.heading('num', text='序号')
-        self.tree.heading('file', text='发票文件')
-        self.tree.heading('rows', text='明细行数')
-
-        self.tree.column('check', width=60, anchor='center')
-        self.tree.column('num', width=80, anchor='center')
-        self.tree.column('file', width=800, anchor='w')
-        self.tree.column('rows', width=150, anchor='center')
-
-        self.tree.pack(side='left', fill='both', expand=True)
-        vsb.pack(side='right', fill='y')
-
-        style = ttk.Style()
-        style.theme_use('clam')
-        style.configure('Treeview.Heading',
-                        background='#e0e0e0',
-                        foreground='black',
-                        relief='raised',
-                        font=('微软雅黑', 10, 'bold'),
-                        padding=8)
-        style.map('Treeview.Heading',
-                  background=[('active', '#d0d0d0')],
-                  relief=[('pressed', '!disabled', 'sunken')])
-
-        self.selected_count_frame = Frame(self.root)
-        self.selected_count_frame.pack(fill='x', padx=10, pady=(0, 5))
-        self.selected_count_label = Label(self.selected_count_frame, text="已有 0 条符合条件的发票文件被选中",
-                                          font=('微软雅黑', 9), fg='gray', anchor='w')
-        self.selected_count_label.pack(side='left')
-
-        ctrl_frame = Frame(self.root)
-        ctrl_frame.pack(fill='x', padx=10, pady=5)
-        ttk.Checkbutton(ctrl_frame, text="全选", variable=self.all_var,
-                        command=self.toggle_all).pack(side='left', padx=5)
-        Button(ctrl_frame, text="反选", command=self.invert_selection,
-               width=8, bg='#f39c12', fg='white').pack(side='left', padx=5)
-        Button(ctrl_frame, text="删除选中", command=self.delete_selected,
-               width=12, bg='#e74c3c', fg='white').pack(side='left', padx=10)
-
-        bottom_frame = Frame(self.root, pady=10)
-        bottom_frame.pack(fill='x', padx=10)
-
-        left_frame = Frame(bottom_frame)
-        left_frame.pack(side='left', fill='y', padx=10)
-        Label(left_frame, text="导出选项:", font=('微软雅黑', 10, 'bold')).pack(anchor='w')
-        mode_frame = Frame(left_frame)
-        mode_frame.pack(anchor='w', pady=5)
-        Radiobutton(mode_frame, text="合并导出（所有发票合并到一个SHEET）",
-                    variable=self.export_mode, value="merge",
-                    font=('微软雅黑', 9)).pack(anchor='w')
-        Radiobutton(mode_frame, text="分表导出（每张发票单独一个SHEET）",
-                    variable=self.export_mode, value="separate",
-                    font=('微软雅黑', 9)).pack(anchor='w', pady=2)
-
-        middle_frame = Frame(bottom_frame)
-        middle_frame.pack(side='left', fill='both', expand=True, padx=20)
-        Label(middle_frame, text="保存路径:", font=('微软雅黑', 10, 'bold')).pack(anchor='w')
-        path_btn_frame = Frame(middle_frame)
-        path_btn_frame.pack(anchor='w', pady=5)
-        Button(path_btn_frame, text="浏览...", command=self.set_save_path,
-               width=10).pack(side='left')
-        Button(path_btn_frame, text="打开文件夹", command=self.open_save_folder,
-               width=10).pack(side='left', padx=5)
-        path_text = self.shorten_path(self.save_path)
-        self.path_label = Label(middle_frame, text=path_text,
-                                fg='blue', font=('微软雅黑', 9),
-                                wraplength=400, justify='left', anchor='w')
-        self.path_label.pack(anchor='w', pady=2)
-
-        right_frame = Frame(bottom_frame)
-        right_frame.pack(side='right', padx=10)
-        Button(right_frame, text="导出EXCEL", command=self.export_to_excel,
-               width=btn_width, height=1, font=('微软雅黑', 10),
-               bg='#27ae60', fg='white').pack()
-
-        current_year = datetime.now().year
-        copyright_text = f"Developed by Nero Diao ©2026-{current_year}"
-        copyright_label = Label(self.root, text=copyright_text,
-                                font=('微软雅黑', 8), fg='#888888', anchor='w')
-        copyright_label.pack(side='bottom', fill='x', padx=15, pady=(0, 8))
-
-    def shorten_path(self, p):
-        p = os.path.normpath(p)
-        if len(p) <= 50:
-            return p
-        return "..." + p[-47:]
-
-    def invert_selection(self):
-        for item in self.tree.get_children():
-            values = list(self.tree.item(item, 'values'))
-            values[0] = '☐' if values[0] == '✓' else '✓'
-            self.tree.item(item, values=values)
-        self.update_selected_count()
-
-    def on_check_click(self, event):
-        region = self.tree.identify_region(event.x, event.y)
-        if region != "cell":
-            return
-        col = self.tree.identify_column(event.x)
-        item = self.tree.identify_row(event.y)
-        if not item or col != '#1':
-            return
-        values = list(self.tree.item(item, 'values'))
-        values[0] = '✓' if values[0] == '☐' else '☐'
-        self.tree.item(item, values=values)
-        self.update_all_var()
-        self.update_selected_count()
-
-    def toggle_all(self):
-        mark = '✓' if self.all_var.get() == "1" else '☐'
-        for item in self.tree.get_children():
-            values = list(self.tree.item(item, 'values'))
-            values[0] = mark
-            self.tree.item(item, values=values)
-        self.update_selected_count()
-
-    def update_all_var(self):
-        checks = [self.tree.item(item, 'values')[0] for item in self.tree.get_children()]
-        if not checks:
-            self.all_var.set("0")
-        elif all(c == '✓' for c in checks):
-            self.all_var.set("1")
-        else:
-            self.all_var.set("0")
-
-    def update_selected_count(self):
-        selected_count = sum(1 for item in self.tree.get_children() if self.tree.item(item, 'values')[0] == '✓')
-        self.selected_count_label.config(text=f"已有 {selected_count} 条符合条件的发票文件被选中")
-
-    def create_progress_dialog(self, total_files):
-        self.loading_dialog = Toplevel(self.root)
-        self.loading_dialog.title("发票导入中")
-        self.loading_dialog.transient(self.root)
-        self.loading_dialog.grab_set()
-        self.loading_dialog.resizable(False, False)
-        self.loading_dialog.configure(bg='#f8f9fa')
-        dialog_width = 420
-        dialog_height = 180
-        self.root.update_idletasks()
-        root_x = self.root.winfo_x()
-        root_y = self.root.winfo_y()
-        root_width = self.root.winfo_width()
-        root_height = self.root.winfo_height()
-        pos_x = root_x + (root_width - dialog_width) // 2
-        pos_y = root_y + (root_height - dialog_height) // 2
-        self.loading_dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
-        main_frame = Frame(self.loading_dialog, bg='#f8f9fa', padx=30, pady=30)
-        main_frame.pack(fill='both', expand=True)
-        Label(main_frame, text="正在导入并解析发票文件，请稍候...",
-              font=('微软雅黑', 11, 'bold'), bg='#f8f9fa', fg='#333333').pack(pady=(0, 20))
-        self.progress_label = Label(main_frame, text=f"当前正在处理第 1 条 / 共 {total_files} 条",
-                                    font=('微软雅黑', 12), bg='#f8f9fa', fg='#2c3e50')
-        self.progress_label.pack(pady=(0, 20))
-        self.progress_var = DoubleVar()
-        style = ttk.Style()
-        style.theme_use('clam')
-        style.configure("Blue.Horizontal.TProgressbar",
-                        background='#4a90e2',
-                        troughcolor='#e0e0e0',
-                        borderwidth=0,
-                        lightcolor='#4a90e2',
-                        darkcolor='#4a90e2',
-                        thickness=24)
-        progress_bar = ttk.Progressbar(main_frame, variable=self.progress_var, maximum=total_files,
-                                       style="Blue.Horizontal.TProgressbar", length=360)
-        progress_bar.pack(pady=(0, 10))
-
-    def update_progress(self, current, total):
-        if self.progress_var is not None:
-            self.progress_var.set(current)
-        if self.progress_label is not None:
-            self.progress_label.config(text=f"当前正在处理第 {current} 条 / 共 {total} 条")
-
-    def safe_close_loading_dialog(self):
-        if self.loading_dialog and self.loading_dialog.winfo_exists():
-            self.loading_dialog.destroy()
-        self.loading_dialog = None
-        self.progress_var = None
-        self.progress_label = None
-
-    def has_invoice_number_in_first_two_pages(self, pdf_path):
-        invoice_no_patterns = [
-            r'发票号码[：:\s]*([0-9]{8,12})',
-            r'发票代码[：:\s]*([0-9]{10,12})',
-            r'No[.:：\s]*([0-9]{8,12})',
-            r'发票号[：:\s]*([0-9]{8,12})',
-        ]
+            for path in files:
+                if not self.put(path):
+                    return
+                self.found += 1
+        finally:
+            self.finished = True
+            self.put(self.END)
+
+    def __iter__(self):
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                pages_to_check = pdf.pages[:2]
-                for page in pages_to_check:
-                    text = page.extract_text()
-                    if not text:
-                        continue
-                    text = text.upper()
-                    for pattern in invoice_no_patterns:
-                        if re.search(pattern, text):
-                            return True
-                return False
-        except:
-            return False
-
-    def add_folder(self):
-        folder = filedialog.askdirectory(title="选择包含发票PDF的文件夹")
-        if not folder:
+            while True:
+                path = self.queue.get()
+                if path is self.END:
+                    return
+                yield path
+        finally:
+            # 消费方提前结束时让枚举线程退出
+            self.stopped.set()
+
+
+def frame_to_json(df):
+    """DataFrame 编码为JSON，同时记录各列类型，读回时恢复数值列和 category 列"""
+    return json.dumps({'columns': list(df.columns), 'data': df.values.tolist(),
+                       'dtypes': {name: str(dtype) for name, dtype in df.dtypes.items()}}, ensure_ascii=False)
+
+
+def frame_from_json(data):
+    payload = json.loads(data)
+    df = pd.DataFrame(payload['data'], columns=payload['columns'])
+    if 'dtypes' in payload:
+        df = df.astype(payload['dtypes'])
+    return df
+
+
+class ParseCache:
+    """发票解析结果缓存：以文件内容哈希+解析器版本为键存入SQLite，超出容量时淘汰最久未使用的记录
+
+    占用字节数在打开时统计一次，之后随写入和删除增减；超出容量时按 last_used 索引一次淘汰一批，
+    降到容量的 CACHE_EVICT_RATIO 以下，不必每次写入都统计整张表。
+    """
+
+    def __init__(self, db_path=CACHE_FILE, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS parse_cache (
+                                 key TEXT PRIMARY KEY,
+                                 status TEXT NOT NULL,
+                                 data TEXT,
+                                 size INTEGER NOT NULL,
+                                 last_used REAL NOT NULL,
+                                 invoice_key TEXT)''')
+        # 淘汰时按使用时间顺序读取 size，只走索引，不读取存放明细的数据页
+        self.conn.execute('CREATE INDEX IF NOT EXISTS parse_cache_lru ON parse_cache (last_used, size)')
+        self.conn.commit()
+        self.total = self.used_bytes()
+
+    def used_bytes(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM parse_cache INDEXED BY parse_cache_lru'
+                                 ).fetchone()[0]
+
+    @staticmethod
+    def key(content_hash):
+        return f"{content_hash}:{PARSER_VERSION}"
+
+    def get(self, key):
+        """返回 (状态, DataFrame, 发票键)，未命中时返回 None"""
+        with self.lock:
+            row = self.conn.execute('SELECT status, data, invoice_key FROM parse_cache WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute('UPDATE parse_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+        status, data, invoice_key = row
+        if data is None:
+            return status, None, invoice_key
+        return status, frame_from_json(data), invoice_key
+
+    def put(self, key, status, df, invoice_key=None):
+        data = None
+        if df is not None:
+            data = frame_to_json(df)
+        size = len(data.encode('utf-8')) if data else 0
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM parse_cache WHERE key = ?', (key,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO parse_cache (key, status, data, size, last_used, invoice_key) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', (key, status, data, size, time.time(), invoice_key))
+            self.total += size - (old[0] if old else 0)
+            if self.total > self.max_bytes:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """淘汰最久未使用的记录，直到占用降到容量的 CACHE_EVICT_RATIO 以下"""
+        # 其他进程（如同时运行的命令行导入）也可能写入，淘汰前重新统计
+        self.total = self.used_bytes()
+        if self.total <= self.max_bytes:
             return
-        pdf_files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith('.pdf')]
-        if not pdf_files:
-            messagebox.showinfo("提示", "所选文件夹中未找到PDF文件")
+        target = self.max_bytes * CACHE_EVICT_RATIO
+        rowids = []
+        for rowid, size in self.conn.execute('SELECT rowid, size FROM parse_cache INDEXED BY parse_cache_lru '
+                                             'ORDER BY last_used'):
+            if self.total <= target:
+                break
+            rowids.append((rowid,))
+            self.total -= size
+        self.conn.executemany('DELETE FROM parse_cache WHERE rowid = ?', rowids)
+
+    def clear(self):
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM parse_cache').fetchone()[0]
+            self.conn.execute('DELETE FROM parse_cache')
+            self.conn.commit()
+            self.conn.execute('VACUUM')
+            self.total = 0
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class InvoiceIndex:
+    """已导出发票的持久索引：以“发票代码:发票号码”为键存入SQLite，再次导入已导出过的发票时在解析明细前拒绝"""
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS exported_invoices (
+                                 invoice_key TEXT PRIMARY KEY,
+                                 path TEXT,
+                                 content_hash TEXT,
+                                 exported_to TEXT,
+                                 exported_at REAL NOT NULL)''')
+        self.conn.commit()
+
+    def keys(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT invoice_key FROM exported_invoices')}
+
+    def add(self, records, exported_to):
+        """记录导出的发票（InvoiceRecord 列表），没有发票键的跳过"""
+        now = time.time()
+        rows = [(r.invoice_key, r.path, r.content_hash, exported_to, now) for r in records if r.invoice_key]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO exported_invoices '
+                                  '(invoice_key, path, content_hash, exported_to, exported_at) '
+                                  'VALUES (?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+        return len(rows)
+
+    def clear(self):
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM exported_invoices').fetchone()[0]
+            self.conn.execute('DELETE FROM exported_invoices')
+            self.conn.commit()
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class StoredFrame:
+    """已落盘的发票明细：只在内存中保留列名和行数，导出时通过 load() 读回 DataFrame"""
+    __slots__ = ('store', 'invoice_id', 'columns', 'row_count')
+
+    def __init__(self, store, invoice_id, columns, row_count):
+        self.store = store
+        self.invoice_id = invoice_id
+        self.columns = columns
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def load(self):
+        return self.store.get(self.invoice_id)
+
+
+class DetailStore:
+    """发票明细的磁盘存储：导入时写入临时目录下的SQLite，导出时按需读回，最近使用的少量明细保留在内存"""
+
+    def __init__(self, hot_frames=DETAIL_HOT_FRAMES):
+        self.hot_frames = hot_frames
+        self.hot = OrderedDict()
+        self.lock = threading.Lock()
+        self.dir = tempfile.mkdtemp(prefix='invoice_details_')
+        self.conn = sqlite3.connect(os.path.join(self.dir, 'details.db'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE details (invoice_id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+
+    def put(self, invoice_id, df):
+        data = frame_to_json(df)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO details (invoice_id, data) VALUES (?, ?)', (invoice_id, data))
+            self.conn.commit()
+            self.remember(invoice_id, df)
+        return StoredFrame(self, invoice_id, list(df.columns), len(df))
+
+    def get(self, invoice_id):
+        with self.lock:
+            df = self.hot.get(invoice_id)
+            if df is not None:
+                self.hot.move_to_end(invoice_id)
+                return df
+            row = self.conn.execute('SELECT data FROM details WHERE invoice_id = ?', (invoice_id,)).fetchone()
+        if row is None:
+            raise KeyError(invoice_id)
+        df = frame_from_json(row[0])
+        with self.lock:
+            self.remember(invoice_id, df)
+        return df
+
+    def remember(self, invoice_id, df):
+        if self.hot_frames <= 0:
             return
-        self.create_progress_dialog(len(pdf_files))
-        def import_thread():
-            self.process_files(pdf_files)
-            self.root.after(0, self.safe_close_loading_dialog)
-        threading.Thread(target=import_thread, daemon=True).start()
-
-    def add_files(self):
-        files = filedialog.askopenfilenames(
-            title="选择发票PDF文件（可多选，支持多页）",
-            filetypes=[("PDF文件", "*.pdf"), ("所有文件", "*.*")]
-        )
-        if files:
-            file_list = list(files)
-            self.create_progress_dialog(len(file_list))
-            def import_thread():
-                self.process_files(file_list)
-                self.root.after(0, self.safe_close_loading_dialog)
-            threading.Thread(target=import_thread, daemon=True).start()
-
-    def process_files(self, files):
-        added = 0
-        failed = 0
-        total = len(files)
-        for idx, path in enumerate(files):
-            self.root.after(0, self.update_progress, idx + 1, total)
-            if path in [inv[0] for inv in self.invoices]:
-                self.root.after(0, lambda p=path: self.tree.insert('', END, values=('☐', 0, os.path.basename(p), "已添加过")))
-                self.root.after(0, self.renumber_treeview)
-                failed += 1
+        self.hot[invoice_id] = df
+        self.hot.move_to_end(invoice_id)
+        while len(self.hot) > self.hot_frames:
+            self.hot.popitem(last=False)
+
+    def remove(self, invoice_id):
+        with self.lock:
+            self.hot.pop(invoice_id, None)
+            self.conn.execute('DELETE FROM details WHERE invoice_id = ?', (invoice_id,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.hot.clear()
+            self.conn.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class InvoiceRecord:
+    """一张已加载的发票：稳定ID、来源路径、明细（DataFrame 或已落盘的 StoredFrame）、显示名、内容哈希、
+    发票键（发票代码:发票号码）和对应的列表行ID"""
+    __slots__ = ('invoice_id', 'path', 'df', 'name', 'content_hash', 'invoice_key', 'item')
+
+    def __init__(self, invoice_id, path, df, name, content_hash=None, invoice_key=None):
+        self.invoice_id = invoice_id
+        self.path = path
+        self.df = df
+        self.name = name
+        self.content_hash = content_hash
+        self.invoice_key = invoice_key
+        self.item = None
+
+
+class InvoiceRegistry:
+    """已加载发票的索引：按ID保存记录（保持添加顺序），可按路径、内容哈希、发票键和列表行ID常数时间查找
+
+    指定 store 时明细写入磁盘，记录中只保留 StoredFrame。
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.records = {}
+        self.by_path = {}
+        self.by_hash = {}
+        self.by_key = {}
+        self.by_item = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(list(self.records.values()))
+
+    def add(self, path, df, name, content_hash=None, invoice_key=None):
+        if self.store is not None:
+            df = self.store.put(self.next_id, df)
+        record = InvoiceRecord(self.next_id, path, df, name, content_hash, invoice_key)
+        self.next_id += 1
+        self.records[record.invoice_id] = record
+        self.by_path[path] = record
+        if content_hash:
+            self.by_hash[content_hash] = record
+        if invoice_key:
+            self.by_key[invoice_key] = record
+        return record
+
+    def bind_item(self, record, item):
+        record.item = item
+        self.by_item[item] = record
+
+    def remove(self, record):
+        self.records.pop(record.invoice_id, None)
+        if self.by_path.get(record.path) is record:
+            del self.by_path[record.path]
+        if record.content_hash and self.by_hash.get(record.content_hash) is record:
+            del self.by_hash[record.content_hash]
+        if record.invoice_key and self.by_key.get(record.invoice_key) is record:
+            del self.by_key[record.invoice_key]
+        if record.item is not None:
+            self.by_item.pop(record.item, None)
+        if self.store is not None:
+            self.store.remove(record.invoice_id)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class FolderWatcher:
+    """监控文件夹：每次轮询对各文件夹（含子文件夹）中的发票文件做 mtime/大小快照，与上次比较得出新增、修改和删除的文件
+
+    新出现或有变化的文件需连续两次快照一致（已写入完成）才报告，避免导入复制到一半的文件。
+    构造时不扫描文件夹，第一次快照在 poll() 中完成，大目录树的遍历不会阻塞界面线程。
+    某个文件夹暂时无法访问（如网络盘断开）时本次跳过该文件夹，保留其快照，不当作文件全部被删除。
+    """
+
+    def __init__(self, folders, known_paths=(), include=DEFAULT_INCLUDE, exclude=()):
+        self.folders = [os.path.normpath(f) for f in folders]
+        self.include = include
+        self.exclude = exclude
+        self.snapshot = {}
+        self.pending = {}
+        # 开始监控前已导入的文件视为已处理，第一次扫描到时直接记入快照，之后有变化才重新导入
+        self.known = {os.path.normpath(archive_root(p)) for p in known_paths}
+
+    def scan_stamps(self):
+        """返回 (各文件的 (mtime, 大小), 本次无法访问的文件夹)"""
+        stamps = {}
+        unreachable = []
+        for folder in self.folders:
+            try:
+                with os.scandir(folder):
+                    pass
+            except OSError:
+                unreachable.append(folder)
                 continue
-            if not self.has_invoice_number_in_first_two_pages(path):
-                self.root.after(0, lambda p=path: self.tree.insert('', END, values=('☐', 0, os.path.basename(p), "非发票")))
-                self.root.after(0, self.renumber_treeview)
-                failed += 1
+            for path in iter_pdf_files(folder, self.include, self.exclude):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stamps[path] = (st.st_mtime_ns, st.st_size)
+        return stamps, unreachable
+
+    def poll(self):
+        """返回 (新增或修改且已稳定的文件, 已删除的文件)"""
+        stamps, unreachable = self.scan_stamps()
+        changed = []
+        pending = {}
+        for path, stamp in stamps.items():
+            if path in self.known:
+                self.known.discard(path)
+                self.snapshot[path] = stamp
                 continue
-            try:
-                df = self.extract_invoice_with_precise_merge(path)
-                if df is not None and not df.empty:
-                    name = os.path.basename(path)
-                    self.invoices.append((path, df, name))
-                    rows_count = len(df)
-                    self.root.after(0, lambda p=path, r=rows_count, n=name: (
-                        self.tree.insert('', END, values=('✓', 0, n, r)) and
-                        self.tree.item(self.tree.get_children()[-1], tags=('success',))
-                    ))
-                    self.root.after(0, self.renumber_treeview)
-                    added += 1
-                else:
-                    self.root.after(0, lambda p=path: self.tree.insert('', END, values=('☐', 0, os.path.basename(p), "0")))
-                    self.root.after(0, self.renumber_treeview)
-                    failed += 1
-            except Exception as e:
-                self.root.after(0, lambda p=path: self.tree.insert('', END, values=('☐', 0, os.path.basename(p), "错误")))
-                self.root.after(0, self.renumber_treeview)
-                failed += 1
-                traceback.print_exc()
-        self.root.after(0, self.update_progress, total, total)
-        self.root.after(0, self.renumber_treeview)
-        self.root.after(0, self.update_selected_count)
-        if added > 0 or failed > 0:
-            self.root.after(0, lambda: self.show_result_dialog(added, failed))
-        if failed == 0 and added > 0:
-            self.root.after(0, lambda: self.all_var.set("1"))
-            self.root.after(0, self.toggle_all)
-        else:
-            self.root.after(0, lambda: self.all_var.set("0"))
-
-    def show_result_dialog(self, added, failed):
-        dialog = Toplevel(self.root)
-        dialog.title("处理结果")
-        dialog.transient(self.root)
-        dialog.grab_set()
-        dialog.resizable(False, False)
-        dialog_width = 360
-        dialog_height = 160
-        self.root.update_idletasks()
-        root_x = self.root.winfo_x()
-        root_y = self.root.winfo_y()
-        root_width = self.root.winfo_width()
-        root_height = self.root.winfo_height()
-        pos_x = root_x + (root_width - dialog_width) // 2
-        pos_y = root_y + (root_height - dialog_height) // 2
-        dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
-        frame = Frame(dialog, padx=20, pady=20)
-        frame.pack(fill='both', expand=True)
-        Label(frame, text=f"处理完成：成功 {added} 个，失败/未识别 {failed} 个\n\n"
-                         f"成功识别的发票已自动勾选",
-              font=('微软雅黑', 10), justify='left').pack()
-        Button(frame, text="确定", width=10, command=dialog.destroy).pack(pady=10)
-
-    def renumber_treeview(self):
-        for i, item in enumerate(self.tree.get_children(), 1):
-            values = list(self.tree.item(item, 'values'))
-            values[1] = i
-            self.tree.item(item, values=values)
-
-    def delete_selected(self):
-        selected = [item for item in self.tree.get_children() if self.tree.item(item, 'values')[0] == '✓']
-        if not selected:
-            messagebox.showinfo("提示", "未选中任何发票")
-            return
-        if not messagebox.askyesno("确认删除", f"确定要删除选中的 {len(selected)} 张发票吗？"):
-            return
-        for item in selected:
-            self.tree.delete(item)
-        remaining_filenames = [self.tree.item(item, 'values')[2] for item in self.tree.get_children()]
-        self.invoices = [inv for inv in self.invoices if inv[2] in remaining_filenames]
-        self.renumber_treeview()
-        self.update_all_var()
-        self.update_selected_count()
-        messagebox.showinfo("删除完成", f"已删除 {len(selected)} 张发票")
-
-    def export_to_excel(self):
-        selected_items = [item for item in self.tree.get_children() if self.tree.item(item, 'values')[0] == '✓']
-        if not selected_items:
-            messagebox.showwarning("未选择", "请至少勾选一张发票进行导出")
-            return
-
-        selected_invoices = []
-        for item in selected_items:
-            display_name = self.tree.item(item, 'values')[2]
-            for inv in self.invoices:
-                if inv[2] == display_name:
-                    selected_invoices.append((inv[0], inv[1].copy(), inv[2]))
-                    break
+            if self.snapshot.get(path) == stamp:
+                continue
+            if self.pending.get(path) == stamp:
+                self.snapshot[path] = stamp
+                changed.append(path)
+            else:
+                pending[path] = stamp
+        # 无法访问的文件夹中等待稳定的文件留到下次再比较
+        roots = tuple(os.path.join(folder, '') for folder in unreachable)
+        if roots:
+            pending.update((path, stamp) for path, stamp in self.pending.items() if path.startswith(roots))
+        self.pending = pending
+        deleted = [path for path in self.snapshot if path not in stamps and not path.startswith(roots)]
+        for path in deleted:
+            del self.snapshot[path]
+        return sorted(changed), deleted
+
+
+class InvoiceProcessor:
+    """不依赖图形界面的处理核心：配置、解析缓存和批量解析调度，供界面和命令行共用"""
+
+    def __init__(self):
+        self.config = configparser.ConfigParser()
+        self.load_config()
 
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"发票明细_{ts}.xlsx"
-        full_path = os.path.join(self.save_path, filename)
+        # 修改默认保存路径为当前登录用户的桌面（兼容所有用户）
+        self.save_path = self.config.get('settings', 'save_path', fallback=os.path.join(os.path.expanduser("~"), "Desktop"))
 
+        # 并行导入的进程数，1 表示在导入线程内逐个解析
         try:
-            with pd.ExcelWriter(full_path, engine='openpyxl') as writer:
-                if self.export_mode.get() == "merge":
-                    dfs_to_merge = []
-                    for _, df, _ in selected_invoices:
-                        if '序号' in df.columns:
-                            df = df.drop(columns=['序号'])
-                        dfs_to_merge.append(df)
-                    combined = pd.concat(dfs_to_merge, ignore_index=True)
-                    combined.insert(0, '序号', range(1, len(combined) + 1))
-                    combined.to_excel(writer, sheet_name="发票明细", index=False)
-                    worksheet = writer.sheets['发票明细']
-                    self.format_numeric_columns(worksheet, combined)
-                    self.add_tax_formula(worksheet, combined)
-                    total_row_idx = len(combined) + 2
-                    worksheet.cell(row=total_row_idx, column=1).value = "合计"
-                    amount_col_idx = None
-                    tax_amount_col_idx = None
-                    for col_idx, col_name in enumerate(combined.columns, 1):
-                        if col_name == '金额':
-                            amount_col_idx = col_idx
-                        elif col_name == '税额':
-                            tax_amount_col_idx = col_idx
-                    if amount_col_idx:
-                        letter = get_column_letter(amount_col_idx)
-                        worksheet.cell(row=total_row_idx, column=amount_col_idx).value = f"=SUM({letter}2:{letter}{total_row_idx-1})"
-                        worksheet.cell(row=total_row_idx, column=amount_col_idx).number_format = '0.00'
-                    if tax_amount_col_idx:
-                        letter = get_column_letter(tax_amount_col_idx)
-                        worksheet.cell(row=total_row_idx, column=tax_amount_col_idx).value = f"=SUM({letter}2:{letter}{total_row_idx-1})"
-                        worksheet.cell(row=total_row_idx, column=tax_amount_col_idx).number_format = '0.00'
-                    for col in range(1, len(combined.columns) + 1):
-                        cell = worksheet.cell(row=total_row_idx, column=col)
-                        cell.font = Font(bold=True)
-                else:
-                    used_names = set()
-                    for idx, (_, df, name) in enumerate(selected_invoices, 1):
-                        if '序号' in df.columns:
-                            df = df.drop(columns=['序号'])
-                        df.insert(0, '序号', range(1, len(df) + 1))
-                        base_name = f"发票{idx}_{os.path.splitext(name)[0][:20]}"
-                        sheet_name = base_name[:31]
-                        i = 1
-                        while sheet_name in used_names:
-                            sheet_name = f"{base_name[:28]}_{i}"[:31]
-                            i += 1
-                        used_names.add(sheet_name)
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                        worksheet = writer.sheets[sheet_name]
-                        self.format_numeric_columns(worksheet, df)
-                        self.add_tax_formula(worksheet, df)
-                        total_row_idx = len(df) + 2
-                        worksheet.cell(row=total_row_idx, column=1).value = "合计"
-                        amount_col_idx = None
-                        tax_amount_col_idx = None
-                        for col_idx, col_name in enumerate(df.columns, 1):
-                            if col_name == '金额':
-                                amount_col_idx = col_idx
-                            elif col_name == '税额':
-                                tax_amount_col_idx = col_idx
-                        if amount_col_idx:
-                            letter = get_column_letter(amount_col_idx)
-                            worksheet.cell(row=total_row_idx, column=amount_col_idx).value = f"=SUM({letter}2:{letter}{total_row_idx-1})"
-                            worksheet.cell(row=total_row_idx, column=amount_col_idx).number_format = '0.00'
-                        if tax_amount_col_idx:
-                            letter = get_column_letter(tax_amount_col_idx)
-                            worksheet.cell(row=total_row_idx, column=tax_amount_col_idx).value = f"=SUM({letter}2:{letter}{total_row_idx-1})"
-                            worksheet.cell(row=total_row_idx, column=tax_amount_col_idx).number_format = '0.00'
-                        for col in range(1, len(df.columns) + 1):
-                            cell = worksheet.cell(row=total_row_idx, column=col)
-                            cell.font = Font(bold=True)
-
-            # 导出成功弹窗
-            dialog = Toplevel(self.root)
-            dialog.title("导出成功！")
-            dialog.transient(self.root)
-            dialog.grab_set()
-            dialog.resizable(False, False)
-            dialog_width = 420
-            dialog_height = 180
-            self.root.update_idletasks()
-            root_x = self.root.winfo_x()
-            root_y = self.root.winfo_y()
-            root_width = self.root.winfo_width()
-            root_height = self.root.winfo_height()
-            pos_x = root_x + (root_width - dialog_width) // 2
-            pos_y = root_y + (root_height - dialog_height) // 2
-            dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
-
-            msg_frame = Frame(dialog, padx=30, pady=20)
-            msg_frame.pack(fill='both', expand=True)
-
-            Label(msg_frame,
-                  text=f"成功导出 {len(selected_invoices)} 张发票明细\n\n"
-                       f"文件：{filename}\n"
-                       f"路径：{os.path.normpath(self.save_path)}",
-                  font=('微软雅黑', 10), justify='left').pack(anchor='w')
-
-            btn_frame = Frame(dialog)
-            btn_frame.pack(pady=(10, 20))
-
-            def close_dialog():
-                dialog.destroy()
-
-            # 打开所在文件夹（立即关闭）
-            Button(btn_frame, text="打开所在文件夹",
-                   font=('微软雅黑', 10),
-                   width=14,
-                   command=lambda: [self.open_save_folder(), close_dialog()]).pack(side='left', padx=8)
-
-            # 打开文件：异步打开，点击后立即关闭窗口
-            def open_file_async():
-                def target():
-                    try:
-                        if os.name == 'nt':
-                            os.startfile(full_path)
-                        else:
-                            subprocess.call(['xdg-open', full_path])
-                    except Exception:
-                        pass
-                threading.Thread(target=target, daemon=True).start()
-
-            Button(btn_frame, text="打开文件",
-                   font=('微软雅黑', 10),
-                   width=10,
-                   command=lambda: [open_file_async(), close_dialog()]).pack(side='left', padx=8)
-
-            # 关闭
-            Button(btn_frame, text="关闭",
-                   font=('微软雅黑', 10),
-                   width=10,
-                   command=close_dialog).pack(side='left', padx=8)
-
-        except Exception as e:
-            messagebox.showerror("导出失败", f"导出过程中发生错误：\n{str(e)}")
-            traceback.print_exc()
+            self.workers = max(1, self.config.getint('settings', 'workers', fallback=os.cpu_count() or 1))
+        except ValueError:
+            self.workers = os.cpu_count() or 1
 
-    def format_numeric_columns(self, worksheet, df):
-        numeric_cols = ['数量', '单价', '金额']
-        col_indices = {}
-        for col_idx, col_name in enumerate(df.columns, 1):
-            if col_name in numeric_cols:
-                col_indices[col_name] = col_idx
-
-        for col_name, col_idx in col_indices.items():
-            letter = get_column_letter(col_idx)
-            for row_idx in range(2, len(df) + 2):
-                cell = worksheet.cell(row=row_idx, column=col_idx)
-                try:
-                    original_str = str(df.iloc[row_idx-2][col_name])
-                    if original_str and original_str != '':
-                        clean_str = original_str.replace(',', '')
-                        num_val = float(clean_str)
-                        cell.value = num_val
-                        if '.' in original_str:
-                            decimals = len(original_str.split('.')[-1])
-                            fmt = f'0.{"0" * decimals}'
-                        else:
-                            fmt = '0'
-                        cell.number_format = fmt
-                except:
-                    cell.number_format = '0.00'
-
-    def add_tax_formula(self, worksheet, df):
-        amount_col_idx = tax_rate_col_idx = tax_amount_col_idx = None
-        for col_idx, col_name in enumerate(df.columns, 1):
-            if col_name == '金额':
-                amount_col_idx = col_idx
-            elif col_name == '税率/征收率':
-                tax_rate_col_idx = col_idx
-            elif col_name == '税额':
-                tax_amount_col_idx = col_idx
-
-        if amount_col_idx and tax_rate_col_idx and tax_amount_col_idx:
-            for row_idx in range(2, len(df) + 2):
-                amount_cell = f"{get_column_letter(amount_col_idx)}{row_idx}"
-                tax_rate_cell = f"{get_column_letter(tax_rate_col_idx)}{row_idx}"
-                tax_amount_cell = f"{get_column_letter(tax_amount_col_idx)}{row_idx}"
-                formula = f'=TRUNC({amount_cell}*SUBSTITUTE({tax_rate_cell},"%","")/100, 2)'
-                worksheet[tax_amount_cell] = formula
-
-    def extract_invoice_with_precise_merge(self, pdf_path):
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                all_goods_lines = []
-                for page_num, page in enumerate(pdf.pages, 1):
-                    full_text = page.extract_text()
-                    if not full_text:
-                        continue
-                    lines = [line.strip() for line in full_text.split('\n') if line.strip()]
-                    goods_section = self.find_goods_section_smart(lines)
-                    if goods_section:
-                        all_goods_lines.extend(goods_section)
-
-                if not all_goods_lines:
-                    return None
-
-                parsed_data = []
-                for line in all_goods_lines:
-                    if self.is_total_line(line):
-                        continue
-                    row_data = self.parse_goods_line_corrected(line)
-                    parsed_data.append(row_data)
-
-                if not parsed_data:
-                    return None
-
-                df = pd.DataFrame(parsed_data)
-                required_cols = ['项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率/征收率', '税额']
-                for col in required_cols:
-                    if col not in df.columns:
-                        df[col] = ""
-
-                df = df[required_cols]
-                df = self.merge_continued_rows(df)
-                df['项目名称'] = df['项目名称'].apply(self.clean_chinese_text)
-                df['规格型号'] = df['规格型号'].apply(self.clean_chinese_text)
-                df.insert(0, '序号', range(1, len(df) + 1))
-                return df
-        except Exception as e:
-            traceback.print_exc()
-            return None
+        # 解析结果缓存，重复导入同一文件时直接复用
+        self.cache = None
+        if self.config.get('cache', 'enabled', fallback='1') == '1':
+            try:
+                max_mb = self.config.getint('cache', 'max_mb', fallback=256)
+                self.cache = ParseCache(CACHE_FILE, max_mb * 1024 * 1024)
+            except Exception as e:
+                print(f"解析缓存不可用: {e}")
 
-    def parse_goods_line_corrected(self, line):
-        row_data = {
-            '项目名称': '', '规格型号': '', '单位': '',
-            '数量': '', '单价': '', '金额': '',
-            '税率/征收率': '', '税额': ''
-        }
-
-        original_line = line
-        line = line.strip()
-        if not line:
-            return row_data
-
-        tax_rate_match = re.search(r'(\d+(?:\.\d+)?%)', line)
-        if tax_rate_match:
-            row_data['税率/征收率'] = tax_rate_match.group(1)
-
-        unit = None
-        unit_pos = -1
-        for u in UNIT_KEYWORDS:
-            pos = line.find(u)
-            if pos != -1:
-                context_start = max(0, pos-5)
-                context_end = min(len(line), pos+len(u)+5)
-                context = line[context_start:context_end]
-                if re.search(r'\d', context):
-                    unit = u
-                    unit_pos = pos
-                    break
-
-        if unit:
-            row_data['单位'] = unit
-
-        if unit and unit_pos != -1:
-            right_part = line[unit_pos + len(unit):].replace(',', '')
-            numbers_raw = re.findall(r'\d+(?:\.\d+)?', right_part)
-        else:
-            line = line.replace(',', '')
-            numbers_raw = re.findall(r'\d+(?:\.\d+)?', line)
-
-        numbers = numbers_raw
-
-        tax_rate_num = row_data['税率/征收率'].rstrip('%') if row_data['税率/征收率'] else None
-        if tax_rate_num and tax_rate_num in numbers:
-            numbers = numbers[::-1]
-            numbers.remove(tax_rate_num)
-            numbers = numbers[::-1]
-
-        if len(numbers) >= 4:
-            row_data['数量'] = numbers[0]
-            row_data['单价'] = numbers[1]
-            row_data['金额'] = numbers[2]
-            row_data['税额'] = numbers[3]
-        elif len(numbers) == 3:
-            row_data['数量'] = numbers[0]
-            row_data['单价'] = numbers[1]
-            row_data['金额'] = numbers[2]
-        elif len(numbers) == 2:
-            row_data['数量'] = numbers[0]
-            row_data['单价'] = numbers[1]
-        elif len(numbers) == 1:
-            row_data['金额'] = numbers[0]
-
-        left_text = original_line
-        if unit and unit_pos != -1:
-            left_text = original_line[:unit_pos].strip()
-        else:
-            if numbers_raw:
-                for num in numbers_raw:
-                    pos = original_line.find(num)
-                    if pos != -1:
-                        left_text = original_line[:pos].strip()
-                        break
-
-        left_text = left_text.replace('**', '')
-        if ' ' in left_text:
-            parts = left_text.split(' ')
-            if len(parts) >= 2:
-                row_data['项目名称'] = parts[0].strip()
-                row_data['规格型号'] = ' '.join(parts[1:]).strip()
-            else:
-                row_data['项目名称'] = left_text.strip()
-        else:
-            row_data['项目名称'] = left_text.strip()
+        # 已导出发票的索引，再次导入同一发票号码时直接拒绝
+        self.index = None
+        self.reject_exported = True
+        if self.config.get('index', 'enabled', fallback='1') == '1':
+            try:
+                self.index = InvoiceIndex(INDEX_FILE)
+            except Exception as e:
+                print(f"导出记录不可用: {e}")
 
-        return row_data
+        # 性能日志（.csv 结尾写CSV，否则写JSON Lines）和逐文件 cProfile 采样，默认都不开启
+        self.perf_log = self.config.get('debug', 'perf_log', fallback='')
+        self.profile_dir = None
+        if self.config.get('debug', 'profile', fallback='0') == '1':
+            self.profile_dir = self.config.get('debug', 'profile_dir', fallback='invoice_profiles')
+        self.last_report = None
 
-    def merge_continued_rows(self, df):
-        if df.empty:
-            return df
+        # 导入文件夹时的文件名过滤
+        self.include = self.config_list('settings', 'include', CONFIG_LIST_SEP.join(DEFAULT_INCLUDE))
+        self.exclude = self.config_list('settings', 'exclude', '')
 
-        key_cols = ['单位', '数量', '单价', '金额']
-        has_key = df[key_cols].notna() & (df[key_cols] != '')
-        is_complete = has_key.any(axis=1)
+        self.invoices = InvoiceRegistry()
 
-        merged_rows = []
-        current_row = None
+    def config_list(self, section, option, fallback):
+        return [item for item in self.config.get(section, option, fallback=fallback).split(CONFIG_LIST_SEP) if item]
 
-        for idx, row in df.iterrows():
-            name_text = str(row['项目名称']).strip()
-            model_text = str(row['规格型号']).strip()
+    def load_config(self):
+        if os.path.exists(CONFIG_FILE):
+            try:
+                self.config.read(CONFIG_FILE, encoding='utf-8')
+            except:
+                pass
 
-            if is_complete[idx]:
-                if current_row is not None:
-                    merged_rows.append(current_row)
-                current_row = row.copy()
-            else:
-                if current_row is None:
-                    current_row = row.copy()
-                else:
-                    # 续行内容追加到规格型号（无论在name_text还是model_text）
-                    append_text = (name_text + " " + model_text).strip()
-                    if append_text:
-                        if current_row['规格型号']:
-                            current_row['规格型号'] += " " + append_text
-                        else:
-                            current_row['规格型号'] = append_text
-
-        if current_row is not None:
-            merged_rows.append(current_row)
-
-        return pd.DataFrame(merged_rows).reset_index(drop=True)
-
-    def clean_chinese_text(self, text):
-        if not text:
-            return ""
-        cleaned = re.sub(r'\s+', ' ', str(text)).strip()
-        cleaned = re.sub(r'\*\s+', '*', cleaned)
-        cleaned = re.sub(r'\s+\*', '*', cleaned)
-        cleaned = re.sub(r'\(\s+', '(', cleaned)
-        cleaned = re.sub(r'\s+\)', ')', cleaned)
-        cleaned = re.sub(r'([\u4e00-\u9fff])\s+([\u4e00-\u9fff])', r'\1\2', cleaned)
-        return cleaned
-
-    def find_goods_section_smart(self, lines):
-        goods_section = []
-        in_goods_section = False
-
-        for line in lines:
-            if not in_goods_section:
-                if self.is_goods_header(line):
-                    in_goods_section = True
+    def iter_parse_results(self, files):
+        """解析一批文件，按完成顺序逐个产出 (输入序号, 路径, 状态, DataFrame, 内容哈希, 发票键)
+
+        files 中的项为文件路径或 iter_sources 展开的 ArchiveMember，后者读入内存后直接交给解析。
+
+        已加载过的路径或内容完全相同的文件直接返回 duplicate，命中缓存的直接返回缓存结果；
+        发票号码与已加载的发票相同时返回 duplicate，已导出过时返回 exported，读完前两页即拒绝，不解析明细。
+        配置了多个进程时其余文件交给进程池并行解析。files 可以是边枚举边产出的迭代器，
+        进程池中排队的文件数有上限，超过时先取回已完成的结果再读取下一个文件。
+        每个文件各阶段的耗时记入 self.last_report，全部完成后写入性能日志。
+        """
+        known_paths = set(self.invoices.by_path)
+        known_hashes = set(self.invoices.by_hash)
+        exported_keys = self.exported_keys()
+        known_keys = set(self.invoices.by_key) | exported_keys
+        report = self.last_report = PerfReport('import')
+        executor = None
+        workers = self.workers if not isinstance(files, list) else min(self.workers, len(files))
+        if workers > 1:
+            # 子进程只拿到开始时的发票键，同一批中先后完成的重复发票在取回结果时再判断
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=set_known_invoices,
+                                           initargs=(frozenset(known_keys),))
+        max_in_flight = workers * IN_FLIGHT_PER_WORKER
+        futures = {}
+        reader = ArchiveReader()
+        try:
+            for idx, source in enumerate(files):
+                path = source.path if isinstance(source, ArchiveMember) else source
+                if path in known_paths:
+                    report.add(path, 'duplicate', 0, {})
+                    yield idx, path, 'duplicate', None, None, None
                     continue
+                known_paths.add(path)
+                cached = None
+                with collect_timings() as stats:
+                    with stage('hash'):
+                        target, content_hash = read_source(source, reader)
+                    duplicate = content_hash is not None and content_hash in known_hashes
+                    if not duplicate:
+                        if content_hash is not None:
+                            known_hashes.add(content_hash)
+                        with stage('cache'):
+                            cached = self.lookup_cache(content_hash)
+                if target is None:
+                    report.add(path, 'error', 0, stats)
+                    yield idx, path, 'error', None, None, None
+                elif duplicate:
+                    report.add(path, 'duplicate', 0, stats)
+                    yield idx, path, 'duplicate', None, content_hash, None
+                elif cached is not None:
+                    status, df, key = cached
+                    status, df = self.check_invoice_key(status, df, key, known_keys, exported_keys)
+                    report.add(path, status, 0 if df is None else len(df), stats)
+                    yield idx, path, status, df, content_hash, key
+                elif executor is not None:
+                    future = executor.submit(parse_invoice_file_timed, target, self.profile_dir,
+                                             self.profile_name(idx, path, content_hash))
+                    futures[future] = (idx, path, content_hash, stats)
+                    if len(futures) >= max_in_flight:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield self.future_result(future, *futures.pop(future), known_keys, exported_keys)
+                else:
+                    try:
+                        status, df, parse_stats, key = parse_invoice_file_timed(
+                            target, self.profile_dir, self.profile_name(idx, path, content_hash), known_keys)
+                        merge_timings(stats, parse_stats)
+                        self.store_cache(content_hash, status, df, key)
+                        status, df = self.check_invoice_key(status, df, key, known_keys, exported_keys)
+                    except Exception:
+                        status, df, key = 'error', None, None
+                        traceback.print_exc()
+                    report.add(path, status, 0 if df is None else len(df), stats)
+                    yield idx, path, status, df, content_hash, key
+
+            for future in as_completed(futures):
+                yield self.future_result(future, *futures[future], known_keys, exported_keys)
+            report.finish()
+            report.write(self.perf_log)
+        finally:
+            reader.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def future_result(self, future, idx, path, content_hash, stats, known_keys, exported_keys):
+        try:
+            status, df, parse_stats, key = future.result()
+            merge_timings(stats, parse_stats)
+            self.store_cache(content_hash, status, df, key)
+            status, df = self.check_invoice_key(status, df, key, known_keys, exported_keys)
+        except Exception:
+            status, df, key = 'error', None, None
+            traceback.print_exc()
+        self.last_report.add(path, status, 0 if df is None else len(df), stats)
+        return idx, path, status, df, content_hash, key
+
+    @staticmethod
+    def check_invoice_key(status, df, key, known_keys, exported_keys):
+        """按发票键判断重复，返回 (状态, DataFrame)；将要加入列表的新发票，其键记入 known_keys"""
+        if key is None or status not in ('parsed', 'duplicate'):
+            return status, df
+        if key in exported_keys:
+            return 'exported', None
+        if status == 'duplicate' or key in known_keys:
+            return 'duplicate', None
+        if df is not None and not df.empty:
+            known_keys.add(key)
+        return status, df
+
+    def expand_archives(self, files):
+        """文件列表中有ZIP包时改为边展开边导入，进度总数为包中的发票数"""
+        if isinstance(files, list) and any(is_archive(path) for path in files):
+            return FileDiscovery(iter_sources(files, self.include, self.exclude))
+        return files
+
+    def exported_keys(self):
+        """已导出过、本次导入需要拒绝的发票键"""
+        if self.index is None or not self.reject_exported:
+            return set()
+        try:
+            return self.index.keys()
+        except Exception:
+            traceback.print_exc()
+            return set()
 
-            if in_goods_section:
-                if self.is_end_of_goods_section(line):
-                    break
-                goods_section.append(line)
-
-        return goods_section
-
-    def is_goods_header(self, line):
-        keywords = ['项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率']
-        return sum(1 for kw in keywords if kw in line) >= 2
-
-    def is_end_of_goods_section(self, line):
-        if any(kw in line for kw in ['合计', '价税合计', '小计', '总计']):
-            if re.search(r'\d{3,}', line.replace(',', '')):
-                return True
+    def record_exported(self, records, full_path):
+        """导出成功后把这些发票记入导出索引"""
+        if self.index is None:
+            return
+        try:
+            self.index.add(records, full_path)
+        except Exception:
+            traceback.print_exc()
 
-        if any(m in line for m in ['税额', '¥', '￥', '备注', '开票人', '收款人']) and re.search(r'\d', line):
-            return True
+    def profile_name(self, idx, path, content_hash):
+        """cProfile 采样文件名：原文件名加内容哈希前缀，便于对应到具体发票"""
+        if not self.profile_dir:
+            return None
+        name = os.path.splitext(os.path.basename(path.split(ARCHIVE_SEP)[-1]))[0]
+        return f"{name}_{content_hash[:8] if content_hash else idx}"
 
-        return False
+    def lookup_cache(self, content_hash):
+        """返回缓存的 (状态, DataFrame, 发票键)；未启用缓存或未命中时返回 None"""
+        if self.cache is None or content_hash is None:
+            return None
+        try:
+            return self.cache.get(self.cache.key(content_hash))
+        except Exception:
+            traceback.print_exc()
+            return None
 
-    def is_total_line(self, line):
-        if any(kw in line for kw in ['合计', '价税合计', '小计', '总计']):
-            if re.search(r'\d{3,}', line.replace(',', '')):
-                return True
-        return False
+    def store_cache(self, content_hash, status, df, invoice_key=None):
+        # 提前拒绝的重复发票没有解析明细，读取出错的发票下次需要重新解析，都不能缓存
+        if self.cache is None or content_hash is None or status in ('duplicate', 'error'):
+            return
+        try:
+            self.cache.put(self.cache.key(content_hash), status, df, invoice_key)
+        except Exception:
+            traceback.print_exc()
 
-    def set_save_path(self):
-        p = filedialog.askdirectory(title="选择导出文件夹", initialdir=self.save_path)
-        if p:
-            self.save_path = os.path.normpath(p)
-            self.path_label.config(text=self.shorten_path(self.save_path))
-            messagebox.showinfo("成功", f"保存路径已更新为：\n{self.save_path}")
 
-    def open_save_folder(self):
-        try:
-            if os.path.exists(self.save_path):
-                if os.name == 'nt':
-                    os.startfile(self.save_path)
-                else:
-                    subprocess.call(['xdg-open', self.save_path])
-        except Exception as e:
-            messagebox.showerror("打开失败", f"无法打开文件夹：\n{str(e)}")
+def collect_pdf_files(inputs, include=DEFAULT_INCLUDE, exclude=()):
+    """展开命令行输入：文件夹递归取其中匹配的文件，文件原样保留，ZIP包展开为其中的发票（ArchiveMember）"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(iter_pdf_files(item, include, exclude))
+        else:
+            files.append(item)
+    return list(iter_sources(files, include, exclude))
+
+
+def run_cli(argv=None):
+    """命令行批处理模式：不创建任何 Tk 窗口，逐个文件输出进度"""
+    from invoice_export import EXPORT_FORMATS, export_invoices
+    parser = argparse.ArgumentParser(description="发票明细导出Excel工具（命令行批处理模式）")
+    parser.add_argument('--input', '-i', nargs='+', help="发票文件（PDF、OFD、XML、ZIP包）或所在文件夹，可指定多个")
+    parser.add_argument('--output', '-o', help="导出文件路径，默认保存到配置的保存路径")
+    parser.add_argument('--mode', choices=['merge', 'separate'],
+                        help="merge 合并到一个SHEET（或一个文件），separate 每张发票一个SHEET（CSV/Parquet 为单独文件）")
+    parser.add_argument('--format', choices=EXPORT_FORMATS,
+                        help="导出格式，默认按 --output 的扩展名，否则使用配置中的设置（xlsx）")
+    parser.add_argument('--workers', type=int, help="并行解析的进程数")
+    parser.add_argument('--include', nargs='+', help="文件夹中要导入的文件名模式，默认使用配置中的设置（*.pdf *.ofd *.xml *.zip）")
+    parser.add_argument('--exclude', nargs='+', help="文件夹中要跳过的文件或子文件夹模式")
+    parser.add_argument('--no-cache', action='store_true', help="本次不读写解析缓存")
+    parser.add_argument('--clear-cache', action='store_true', help="清空解析缓存")
+    parser.add_argument('--allow-exported', action='store_true', help="本次允许导入已导出过的发票")
+    parser.add_argument('--clear-index', action='store_true', help="清空导出记录")
+    args = parser.parse_args(argv)
+    if not args.input and not args.clear_cache and not args.clear_index:
+        parser.error("请通过 --input 指定发票文件或文件夹")
+
+    processor = InvoiceProcessor()
+    if args.clear_cache and processor.cache is not None:
+        print(f"已清空 {processor.cache.clear()} 条解析缓存")
+    if args.clear_index and processor.index is not None:
+        print(f"已清空 {processor.index.clear()} 条导出记录")
+    processor.reject_exported = not args.allow_exported
+    if args.no_cache and processor.cache is not None:
+        processor.cache.close()
+        processor.cache = None
+    if not args.input:
+        return 0
+    if args.workers is not None:
+        processor.workers = max(1, args.workers)
+    mode = args.mode or processor.config.get('settings', 'export_mode', fallback="merge")
+    fmt = args.format
+    if fmt is None and args.output:
+        ext = os.path.splitext(args.output)[1].lower().lstrip('.')
+        fmt = ext if ext in EXPORT_FORMATS else None
+    if fmt is None:
+        fmt = processor.config.get('settings', 'export_format', fallback="xlsx")
+
+    files = collect_pdf_files(args.input, args.include or processor.include,
+                              processor.exclude if args.exclude is None else args.exclude)
+    if not files:
+        print("未找到发票文件")
+        return 1
+
+    total = len(files)
+    parsed = {}
+    failed = 0
+    for done, (idx, path, status, df, content_hash, invoice_key) in enumerate(
+            processor.iter_parse_results(files), 1):
+        if status == 'parsed' and df is not None and not df.empty:
+            parsed[idx] = (path, df, display_name(path), content_hash, invoice_key)
+            result_text = f"{len(df)} 行"
+        else:
+            failed += 1
+            result_text = STATUS_TEXT.get(status, "未识别到明细")
+        print(f"[{done}/{total}] {path}  {result_text}", flush=True)
+
+    if processor.last_report is not None:
+        print(processor.last_report.summary())
+    if not parsed:
+        print("没有可导出的发票明细")
+        return 1
+    for idx in sorted(parsed):
+        processor.invoices.add(*parsed[idx])
+
+    full_path = args.output
+    if not full_path:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        full_path = os.path.join(processor.save_path, f"发票明细_{ts}.{fmt}")
+    report = PerfReport('export')
+    with collect_timings() as stats:
+        out_path = export_invoices(full_path, [(r.path, r.df, r.name) for r in processor.invoices], mode, fmt)
+    report.add(out_path, mode, sum(len(r.df) for r in processor.invoices), stats)
+    report.finish().write(processor.perf_log)
+    processor.record_exported(list(processor.invoices), out_path)
+    print(f"处理完成：成功 {len(parsed)} 个，失败/未识别 {failed} 个")
+    print(f"已导出：{os.path.abspath(out_path)}")
+    print(report.summary())
+    return 0
 
 
 if __name__ == "__main__":
-    root = Tk()
-    app = InvoiceApp(root)
-    root.mainloop()
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(run_cli())
+    from invoice_gui import main
+    main()
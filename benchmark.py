@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+解析/导出流水线基准测试：离线生成合成电子发票PDF，测量各阶段吞吐量和内存峰值，
+并与保存的标准结果（benchmark_golden.json）比对解析和导出是否发生变化。
+
+    python benchmark.py                              # 默认 20 张发票，每张 20 行、1 页
+    python benchmark.py --files 1000 --lines 200 --pages 5 --workers 4
+    python benchmark.py --update-golden              # 确认解析结果正确后更新标准结果
+    python benchmark.py --compare 上次的报告.json    # 与之前的运行结果对比
+
+生成的PDF不依赖 reportlab：使用阅读器内置的 STSong-Light 字体（不嵌入），
+相同参数和随机种子生成的文件逐字节相同，解析结果可以与标准结果直接比对。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+import pdfplumber
+from openpyxl import load_workbook
+
+from invoice_export import export_invoices
+from invoice_parser import PARSER_VERSION, extract_goods_from_texts, parse_invoice_file_timed
+from invoice_perf import PerfReport, collect_timings, peak_memory_mb
+
+GOLDEN_FILE = 'benchmark_golden.json'
+RESULTS_DIR = 'benchmark_results'
+# 每页最多排多少行明细，超过时自动增加页数
+LINES_PER_PAGE = 60
+# 文件数超过该值时跳过分表导出（每张发票一个工作表）
+SEPARATE_EXPORT_LIMIT = 500
+
+ITEMS = ['*办公用品*签字笔', '*办公用品*复印纸', '*计算机配件*键盘', '*计算机配件*鼠标', '*食品*矿泉水',
+         '*餐饮服务*餐费', '*运输服务*客运服务费', '*信息技术服务*软件服务费', '*电子元件*电阻', '*劳保用品*手套']
+SPECS = ['', 'A4 70g', 'USB 有线', '550ml', 'M 号', '0.5mm 黑色', '标准版']
+UNITS = ['个', '件', '套', '台', '张', '箱', '盒', '包', '瓶', '支', '次', '千克']
+TAX_RATES = ['13%', '9%', '6%', '3%']
+
+
+# ---------------------------------------------------------------- 合成发票
+
+def invoice_lines(rng, line_count):
+    """生成一张发票的明细行文字，约十分之一的明细带一条续行；返回 (文字行列表, 明细条数)"""
+    lines = []
+    for _ in range(line_count):
+        item = rng.choice(ITEMS)
+        spec = rng.choice(SPECS)
+        unit = rng.choice(UNITS)
+        quantity = rng.randint(1, 500)
+        price = rng.randint(50, 500000) / 100
+        amount = quantity * price
+        rate = rng.choice(TAX_RATES)
+        tax = amount * float(rate.rstrip('%')) / 100
+        name = f"{item} {spec}" if spec else item
+        lines.append(f"{name} {unit} {quantity} {price:.2f} {amount:.2f} {rate} {tax:.2f}")
+        if rng.random() < 0.1:
+            lines.append("续行说明 加长款")
+    return lines, line_count
+
+
+def invoice_pages(invoice_no, lines, pages):
+    """把明细行分到各页，每页带表头和小计行，首页带发票号码和购销方信息"""
+    pages = max(pages, -(-len(lines) // LINES_PER_PAGE), 1)
+    per_page = -(-len(lines) // pages) if lines else 0
+    result = []
+    for page_idx in range(pages):
+        body = lines[page_idx * per_page:(page_idx + 1) * per_page]
+        text = [f"电子发票（增值税专用发票） 发票号码：{invoice_no} 开票日期：2024年05月06日"]
+        if page_idx == 0:
+            text += ["购买方信息 名称：某某科技有限公司 统一社会信用代码/纳税人识别号：91310000MA1FL0XXXX",
+                     "销售方信息 名称：某某商贸有限公司 统一社会信用代码/纳税人识别号：91310000MA1FL1XXXX"]
+        text.append("项目名称 规格型号 单位 数量 单价 金额 税率/征收率 税额")
+        text += body
+        text.append(f"小计 ¥{1000 + page_idx}.00 ¥{130 + page_idx}.00")
+        if page_idx == pages - 1:
+            text += ["价税合计（大写） 壹仟元整 （小写）¥1000.00", "备注：基准测试合成发票", "开票人：张三"]
+        result.append(text)
+    return result
+
+
+def pdf_bytes(pages):
+    """最小的多页PDF：Type0 字体 STSong-Light + UniGB-UCS2-H 编码，文字按 UTF-16BE 写入，内容流压缩"""
+    objects = [None, None,
+               b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+               b"/DescendantFonts [4 0 R] >>",
+               b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+               b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+               b"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+               b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+               b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>"]
+    kids = []
+    for lines in pages:
+        ops = [b"BT /F1 8 Tf"]
+        y = 810
+        for line in lines:
+            ops.append(b"1 0 0 1 40 %d Tm <%s> Tj" % (y, line.encode('utf-16-be').hex().encode()))
+            y -= 12
+        ops.append(b"ET")
+        stream = zlib.compress(b"\n".join(ops))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(b"%d 0 R" % len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def generate_corpus(folder, files, lines, pages, seed):
+    """在 folder 中生成合成发票和 manifest.json；参数相同的语料已存在时直接复用"""
+    config = {'files': files, 'lines': lines, 'pages': pages, 'seed': seed}
+    manifest_path = os.path.join(folder, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['config'] == config:
+            return manifest
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = {'config': config, 'invoices': []}
+    for idx in range(files):
+        invoice_no = f"24{seed % 100:02d}{idx:016d}"
+        text_lines, expected_rows = invoice_lines(rng, lines)
+        page_texts = invoice_pages(invoice_no, text_lines, pages)
+        name = f"invoice_{idx:05d}.pdf"
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(pdf_bytes(page_texts))
+        manifest['invoices'].append({'file': name, 'expected_rows': expected_rows,
+                                     'page_texts': ["\n".join(text) for text in page_texts]})
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return manifest
+
+
+# ---------------------------------------------------------------- 测量
+
+def frame_digest(df):
+    if df is None:
+        return None
+    return hashlib.sha256(df.to_csv(index=False).encode('utf-8')).hexdigest()
+
+
+def workbook_digest(path):
+    """导出文件中所有单元格的值和数字格式的摘要（xlsx 本身含时间戳，不能直接比较文件）"""
+    digest = hashlib.sha256()
+    wb = load_workbook(path, read_only=True)
+    for ws in wb.worksheets:
+        digest.update(ws.title.encode('utf-8'))
+        for row in ws.iter_rows():
+            digest.update(repr([(cell.value, cell.number_format) for cell in row]).encode('utf-8'))
+    wb.close()
+    return digest.hexdigest()
+
+
+def bench_parse_text(manifest):
+    """只测文字解析（定位明细区、解析行、合并续行），不含PDF文字提取"""
+    report = PerfReport('parse_text')
+    rows = 0
+    for invoice in manifest['invoices']:
+        with collect_timings() as stats:
+            df = extract_goods_from_texts(invoice['page_texts'])
+        rows += 0 if df is None else len(df)
+        report.add(invoice['file'], 'parsed', 0 if df is None else len(df), stats)
+    return report.finish(), rows
+
+
+def bench_parse_pdf(folder, manifest, workers):
+    report = PerfReport('parse_pdf')
+    paths = [os.path.join(folder, invoice['file']) for invoice in manifest['invoices']]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_invoice_file_timed, paths, chunksize=4))
+    else:
+        results = [parse_invoice_file_timed(path) for path in paths]
+    frames = {}
+    for invoice, path, (status, df, stats, _) in zip(manifest['invoices'], paths, results):
+        report.add(invoice['file'], status, 0 if df is None else len(df), stats)
+        frames[invoice['file']] = (status, df)
+    return report.finish(), frames
+
+
+def file_digest(path):
+    """CSV / Parquet 导出文件的摘要；Parquet 读回后按CSV文本计算，不受文件元数据影响"""
+    if path.endswith('.parquet'):
+        return frame_digest(pd.read_parquet(path))
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def bench_export(folder, frames, mode, fmt='xlsx'):
+    name = f'export_{mode}' if fmt == 'xlsx' else f'export_{fmt}_{mode}'
+    report = PerfReport(name)
+    selected = [(name, df, name) for name, (_, df) in frames.items() if df is not None]
+    path = os.path.join(folder, f'{name}.{fmt}')
+    with collect_timings() as stats:
+        path = export_invoices(path, selected, mode, fmt)
+    rows = sum(len(df) for _, df, _ in selected)
+    report.add(path, mode, rows, stats)
+    return report.finish(), path, rows
+
+
+def stage_result(report, items, rows, unit_name):
+    elapsed = report.elapsed or 1e-9
+    return {
+        'seconds': round(report.elapsed, 4),
+        'items': items,
+        'rows': rows,
+        f'{unit_name}_per_sec': round(items / elapsed, 2),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'cpu_seconds': round(sum(r['stats']['total'][1] for r in report.records), 4),
+        'peak_mb': report.peak_mb(),
+        'stages': {name: [round(wall, 4), round(cpu, 4)] for name, (wall, cpu) in report.stage_totals().items()},
+    }
+
+
+def run(args):
+    config = {'files': args.files, 'lines': args.lines, 'pages': args.pages, 'seed': args.seed}
+    signature = f"files={args.files},lines={args.lines},pages={args.pages},seed={args.seed}"
+    folder = args.corpus or os.path.join(tempfile.gettempdir(), 'invoice_benchmark',
+                                         signature.replace(',', '_').replace('=', ''))
+    print(f"语料目录：{folder}")
+    started = time.perf_counter()
+    manifest = generate_corpus(folder, args.files, args.lines, args.pages, args.seed)
+    print(f"生成/复用语料：{time.perf_counter() - started:.1f} 秒")
+
+    results = {}
+    report, rows = bench_parse_text(manifest)
+    results['parse_text'] = stage_result(report, len(manifest['invoices']), rows, 'files')
+
+    report, frames = bench_parse_pdf(folder, manifest, args.workers)
+    rows = sum(len(df) for _, df in frames.values() if df is not None)
+    results['parse_pdf'] = stage_result(report, len(frames), rows, 'files')
+
+    exports = {}
+    for mode in ('merge', 'separate'):
+        if mode == 'separate' and len(frames) > SEPARATE_EXPORT_LIMIT:
+            print(f"文件数超过 {SEPARATE_EXPORT_LIMIT}，跳过分表导出")
+            continue
+        report, path, rows = bench_export(folder, frames, mode)
+        results[f'export_{mode}'] = stage_result(report, 1, rows, 'exports')
+        exports[mode] = path
+    # 只需要明细行时的导出格式，只测合并导出
+    for fmt in ('csv', 'parquet'):
+        if fmt == 'parquet' and not parquet_available():
+            print("未安装 pyarrow，跳过 Parquet 导出")
+            continue
+        report, path, rows = bench_export(folder, frames, 'merge', fmt)
+        results[f'export_{fmt}_merge'] = stage_result(report, 1, rows, 'exports')
+        exports[f'{fmt}_merge'] = path
+
+    # 正确性：明细行数与生成时一致，解析和导出结果与标准结果一致
+    problems = []
+    for invoice in manifest['invoices']:
+        status, df = frames[invoice['file']]
+        got = 0 if df is None else len(df)
+        if status != 'parsed' or got != invoice['expected_rows']:
+            problems.append(f"{invoice['file']}: 期望 {invoice['expected_rows']} 行，实际 {status} {got} 行")
+    current = {
+        'parser_version': PARSER_VERSION,
+        'files': {name: {'status': status, 'rows': 0 if df is None else len(df), 'digest': frame_digest(df)}
+                  for name, (status, df) in frames.items()},
+        'exports': {mode: workbook_digest(path) if path.endswith('.xlsx') else file_digest(path)
+                    for mode, path in exports.items()},
+    }
+    golden_all = {}
+    if os.path.exists(args.golden):
+        with open(args.golden, encoding='utf-8') as f:
+            golden_all = json.load(f)
+    golden = golden_all.get(signature)
+    if args.update_golden:
+        golden_all[signature] = current
+        with open(args.golden, 'w', encoding='utf-8') as f:
+            json.dump(golden_all, f, ensure_ascii=False, indent=1, sort_keys=True)
+        print(f"已更新标准结果：{args.golden} [{signature}]")
+    elif golden is None:
+        print(f"{args.golden} 中没有 [{signature}] 的标准结果，跳过比对（可用 --update-golden 生成）")
+    else:
+        for name, expected in golden['files'].items():
+            if current['files'].get(name) != expected:
+                problems.append(f"{name}: 解析结果与标准结果不同")
+        for mode, digest in golden['exports'].items():
+            if mode in current['exports'] and current['exports'][mode] != digest:
+                problems.append(f"export_{mode}: 导出内容与标准结果不同")
+
+    result = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'config': dict(config, workers=args.workers),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'pandas': pd.__version__, 'pdfplumber': pdfplumber.__version__,
+                        'parser_version': PARSER_VERSION, 'cpu_count': os.cpu_count()},
+        'results': results,
+        'peak_mb': peak_memory_mb(),
+        'problems': problems,
+    }
+    print_results(result)
+    report_path = args.report or os.path.join(
+        RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"报告已保存：{report_path}")
+    if args.compare:
+        compare(args.compare, result)
+    for problem in problems[:20]:
+        print(f"  ✗ {problem}")
+    return 1 if problems else 0
+
+
+def print_results(result):
+    for name, r in result['results'].items():
+        rate_key = next(key for key in r if key.endswith('_per_sec') and key != 'rows_per_sec')
+        print(f"{name:16s} {r['seconds']:9.2f} 秒  {r[rate_key]:10.1f} {rate_key}  "
+              f"{r['rows_per_sec']:12.1f} rows/sec  峰值 {r['peak_mb']} MB")
+        for stage_name, (wall, cpu) in r['stages'].items():
+            print(f"    {stage_name:20s} {wall:8.3f} 秒  CPU {cpu:8.3f} 秒")
+
+
+def compare(previous_path, result):
+    """按阶段打印与之前报告的耗时变化"""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    if previous['config'] != result['config']:
+        print(f"注意：两次运行的参数不同 {previous['config']} / {result['config']}")
+    for name, r in result['results'].items():
+        old = previous['results'].get(name)
+        if old is None:
+            continue
+        change = (r['seconds'] - old['seconds']) / old['seconds'] if old['seconds'] else 0.0
+        print(f"{name:16s} {old['seconds']:9.2f} -> {r['seconds']:9.2f} 秒 ({change:+.1%})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="发票解析/导出基准测试（离线生成合成发票）")
+    parser.add_argument('--files', type=int, default=20, help="发票文件数（10 ~ 10000）")
+    parser.add_argument('--lines', type=int, default=20, help="每张发票的明细行数（1 ~ 2000）")
+    parser.add_argument('--pages', type=int, default=1, help="每张发票的页数（1 ~ 50），行数放不下时自动增加")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子，相同参数生成的语料完全相同")
+    parser.add_argument('--workers', type=int, default=1, help="解析PDF的进程数")
+    parser.add_argument('--corpus', help="语料目录，默认放在系统临时目录并按参数复用")
+    parser.add_argument('--report', help="结果报告路径，默认 benchmark_results/benchmark_时间.json")
+    parser.add_argument('--golden', default=GOLDEN_FILE, help="标准结果文件")
+    parser.add_argument('--update-golden', action='store_true', help="用本次结果更新标准结果")
+    parser.add_argument('--compare', help="与之前的报告对比各阶段耗时")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+发票明细导出Excel：使用 openpyxl 只写模式，数值和数字格式按列预先算好，
+每一行连同格式、税额公式只写入一次，导出耗时随行数线性增长。
+合并导出时逐张发票流式写入，不拼接总表，峰值内存与所选发票数量无关。
+明细可以是 DataFrame，也可以是提供 columns、len() 和 load() 的落盘明细，写到该发票时才读回。
+解析器输出的数值列已是 float64，数字格式由对应的小数位数列直接给出，导出时不再解析文本。
+
+只需要明细行时可导出为 CSV（UTF-8 BOM，Excel 可直接打开）或 Parquet（数值列为 float64，需要 pyarrow），
+逐张发票流式写入，不生成公式和合计行；合并导出时多一列来源文件，分表导出时每张发票一个文件。
+"""
+
+import csv
+import os
+import re
+import shutil
+from functools import lru_cache
+from itertools import islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from invoice_parser import ARCHIVE_SEP, DECIMALS_SUFFIX, NUMERIC_DETAIL_COLUMNS
+from invoice_perf import stage
+
+MERGED_SHEET_NAME = "发票明细"
+NUMERIC_COLUMNS = ['数量', '单价', '金额']
+TOTAL_FONT = Font(bold=True)
+# 每写入这么多行汇报一次进度并检查是否取消
+EXPORT_BATCH_ROWS = 500
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+# CSV / Parquet 合并导出时标明每行来自哪张发票
+SOURCE_COLUMN = '来源文件'
+# 工作表名和Windows文件名中都不允许的字符
+INVALID_NAME_RE = re.compile(r'[\\/*?:\[\]<>|"]')
+
+
+class ExportCancelled(Exception):
+    """导出过程中用户点击了取消"""
+
+
+@lru_cache(maxsize=65536)
+def parse_number(text):
+    """'1,234.50' -> (1234.5, '0.00')：数字格式的小数位数与原文本一致；空文本不设格式，无法转换时格式为 0.00"""
+    if text == '':
+        return text, None
+    try:
+        value = float(text.replace(',', ''))
+    except ValueError:
+        return text, '0.00'
+    if '.' in text:
+        return value, '0.' + '0' * len(text.split('.')[-1])
+    return value, '0'
+
+
+@lru_cache(maxsize=None)
+def decimals_format(decimals):
+    return '0.' + '0' * decimals if decimals > 0 else '0'
+
+
+def typed_numeric_column(series, decimals):
+    """float64 数值列和小数位数列转换为 (值列表, 数字格式列表)；小数位数为 -1 的空值写成空文本、不设格式"""
+    values = []
+    formats = []
+    for value, places in zip(series.tolist(), decimals.tolist()):
+        if places < 0:
+            values.append('')
+            formats.append(None)
+        else:
+            values.append(value)
+            formats.append(decimals_format(places))
+    return values, formats
+
+
+def numeric_column(series):
+    """把文本数值列转换为 (值列表, 数字格式列表)，相同文本只解析一次；缺失值写成空单元格"""
+    values = []
+    formats = []
+    for raw in series.tolist():
+        if raw is None or raw != raw:
+            value, fmt = None, None
+        else:
+            value, fmt = parse_number(str(raw))
+            if fmt == '0.00' and not isinstance(value, float):
+                value = raw
+        values.append(value)
+        formats.append(fmt)
+    return values, formats
+
+
+def column_values(series):
+    """普通列转换为Python值列表，缺失值写成空单元格"""
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def load_frame(df):
+    """落盘明细在写入前读回为 DataFrame"""
+    return df.load() if hasattr(df, 'load') else df
+
+
+def detail_columns(dfs):
+    """导出的列顺序：序号在最前，其余列按各发票中首次出现的顺序"""
+    columns = ['序号']
+    for df in dfs:
+        for name in df.columns:
+            if name not in columns and not name.endswith(DECIMALS_SUFFIX):
+                columns.append(name)
+    return columns
+
+
+def write_detail_sheet(ws, dfs, on_batch=None):
+    """把一组发票明细依次流式写入只写工作表：表头、连续编号的明细行、合计行
+
+    每张发票写完即释放其转换出的行数据，合并导出时内存占用不随发票数量增长。
+    """
+    dfs = list(dfs)
+    columns = detail_columns(dfs)
+    ws.append(columns)
+    row_count = 0
+    for df in dfs:
+        row_count += write_detail_rows(ws, load_frame(df), columns, row_count + 2, on_batch)
+    ws.append(total_row(ws, columns, row_count + 2))
+
+
+def write_detail_rows(ws, df, columns, first_row_idx, on_batch=None):
+    """按 columns 顺序追加一张发票的明细行，first_row_idx 为其第一行的Excel行号，返回写入行数
+
+    每写完一批行调用 on_batch(工作表名, 本批行数)。
+    """
+    col_pos = {name: idx for idx, name in enumerate(columns)}
+    row_count = len(df)
+
+    first_seq = first_row_idx - 1
+    data = [list(range(first_seq, first_seq + row_count))]
+    data.extend(column_values(df[name]) if name in df.columns else [None] * row_count for name in columns[1:])
+    for name in NUMERIC_COLUMNS:
+        if name not in col_pos or name not in df.columns:
+            continue
+        if name + DECIMALS_SUFFIX in df.columns:
+            values, formats = typed_numeric_column(df[name], df[name + DECIMALS_SUFFIX])
+        else:
+            values, formats = numeric_column(df[name])
+        cells = []
+        for value, fmt in zip(values, formats):
+            if fmt is None:
+                cells.append(value)
+            else:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.number_format = fmt
+                cells.append(cell)
+        data[col_pos[name]] = cells
+
+    if '金额' in col_pos and '税率/征收率' in col_pos and '税额' in col_pos:
+        amount = get_column_letter(col_pos['金额'] + 1)
+        tax_rate = get_column_letter(col_pos['税率/征收率'] + 1)
+        data[col_pos['税额']] = [
+            f'=TRUNC({amount}{row_idx}*SUBSTITUTE({tax_rate}{row_idx},"%","")/100, 2)'
+            for row_idx in range(first_row_idx, first_row_idx + row_count)
+        ]
+
+    rows = zip(*data)
+    for batch_start in range(0, row_count, EXPORT_BATCH_ROWS):
+        for row in islice(rows, EXPORT_BATCH_ROWS):
+            ws.append(row)
+        if on_batch is not None:
+            on_batch(ws.title, min(EXPORT_BATCH_ROWS, row_count - batch_start))
+    return row_count
+
+
+def total_row(ws, columns, total_row_idx):
+    """合计行：第一列写“合计”，金额和税额列求和，整行加粗"""
+    cells = []
+    for col_idx, name in enumerate(columns, 1):
+        cell = WriteOnlyCell(ws)
+        if col_idx == 1:
+            cell.value = "合计"
+        elif name in ('金额', '税额'):
+            letter = get_column_letter(col_idx)
+            cell.value = f"=SUM({letter}2:{letter}{total_row_idx - 1})"
+            cell.number_format = '0.00'
+        cell.font = TOTAL_FONT
+        cells.append(cell)
+    return cells
+
+
+def sheet_names(selected_invoices):
+    """分表导出时每张发票的工作表名（也用作分文件导出的文件名），替换非法字符、截断到31个字符并去重
+
+    压缩包中的发票（显示名为“压缩包名::成员文件名”）只用成员文件名。
+    """
+    used_names = set()
+    for idx, (_, _, name) in enumerate(selected_invoices, 1):
+        stem = os.path.splitext(name.split(ARCHIVE_SEP)[-1])[0]
+        base_name = f"发票{idx}_{INVALID_NAME_RE.sub('_', stem)[:20]}"
+        sheet_name = base_name[:31]
+        i = 1
+        while sheet_name in used_names:
+            sheet_name = f"{base_name[:28]}_{i}"[:31]
+            i += 1
+        used_names.add(sheet_name)
+        yield sheet_name
+
+
+def write_excel(full_path, selected_invoices, mode, progress=None, cancel_event=None):
+    """把 (路径, DataFrame, 文件名) 列表写入Excel，mode 为 merge 或 separate
+
+    progress(已写行数, 总行数, 工作表名) 在每个工作表开始和每批行写完后调用，保存文件前工作表名为 None；
+    cancel_event 被置位时抛出 ExportCancelled，不留下导出文件。
+    """
+    total_rows = sum(len(df) for _, df, _ in selected_invoices)
+    written = 0
+
+    def on_batch(sheet_name, rows):
+        nonlocal written
+        written += rows
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled()
+        if progress is not None:
+            progress(written, total_rows, sheet_name)
+
+    wb = Workbook(write_only=True)
+    try:
+        with stage('write_rows'):
+            if mode == "merge":
+                ws = wb.create_sheet(MERGED_SHEET_NAME)
+                on_batch(ws.title, 0)
+                write_detail_sheet(ws, [df for _, df, _ in selected_invoices], on_batch)
+            else:
+                for (_, df, _), sheet_name in zip(selected_invoices, sheet_names(selected_invoices)):
+                    ws = wb.create_sheet(sheet_name)
+                    on_batch(ws.title, 0)
+                    write_detail_sheet(ws, [df], on_batch)
+            on_batch(None, 0)
+    except BaseException:
+        # 放弃未保存的工作簿：结束各工作表的写入流，临时文件由 openpyxl 退出时清理
+        for ws in wb.worksheets:
+            ws.close()
+        raise
+
+    try:
+        with stage('save'):
+            wb.save(full_path)
+    except BaseException:
+        # 保存中途失败时删除写了一半的文件
+        if os.path.exists(full_path):
+            os.remove(full_path)
+        raise
+
+
+def export_invoices(full_path, selected_invoices, mode, fmt='xlsx', progress=None, cancel_event=None):
+    """按格式导出，参数与 write_excel 相同，返回写出的路径
+
+    csv / parquet 合并导出写入 full_path；分表导出写入与 full_path 同名（去掉扩展名）的文件夹，每张发票一个文件。
+    """
+    if fmt == 'xlsx':
+        write_excel(full_path, selected_invoices, mode, progress, cancel_event)
+        return full_path
+    writer = write_csv_file if fmt == 'csv' else write_parquet_file
+    if mode == 'merge':
+        try:
+            writer(full_path, selected_invoices, True, progress, cancel_event)
+        except BaseException:
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            raise
+        return full_path
+
+    folder = os.path.splitext(full_path)[0]
+    created = not os.path.exists(folder)
+    os.makedirs(folder, exist_ok=True)
+    total_rows = sum(len(df) for _, df, _ in selected_invoices)
+    written = 0
+
+    def invoice_progress(done, total, sheet_name):
+        if progress is not None:
+            progress(written + done, total_rows, sheet_name)
+
+    try:
+        for invoice, name in zip(selected_invoices, sheet_names(selected_invoices)):
+            writer(os.path.join(folder, f"{name}.{fmt}"), [invoice], False, invoice_progress, cancel_event)
+            written += len(invoice[1])
+    except BaseException:
+        if created:
+            shutil.rmtree(folder, ignore_errors=True)
+        raise
+    if progress is not None:
+        progress(total_rows, total_rows, None)
+    return folder
+
+
+def export_columns(selected_invoices, with_source, text_numbers):
+    """先产出统一的列名列表，再逐张发票产出 (来源文件名, 各列值列表)：序号连续，缺失的列为空
+
+    text_numbers 为真时数值列按原小数位数转换为文本（CSV），否则为 float（Parquet）。
+    不构造中间 DataFrame，每张发票的开销只有按列取值。
+    """
+    columns = detail_columns([df for _, df, _ in selected_invoices])
+    if with_source:
+        columns.insert(1, SOURCE_COLUMN)
+    yield columns
+    seq = 1
+    for _, df, name in selected_invoices:
+        df = load_frame(df)
+        row_count = len(df)
+        data = [list(range(seq, seq + row_count))]
+        for column in columns[1:]:
+            if column == SOURCE_COLUMN:
+                data.append([name] * row_count)
+            elif column not in df.columns:
+                data.append([None] * row_count)
+            elif column in NUMERIC_DETAIL_COLUMNS:
+                data.append(number_values(df, column, text_numbers))
+            else:
+                data.append(column_values(df[column]))
+        seq += row_count
+        yield name, data
+
+
+def number_values(df, column, as_text):
+    """数值列：文本按原小数位数写出，空值为空；float64 保留 NaN。旧版文本明细先转换为数值
+
+    无法转换为数字的原文本写CSV时原样保留；Parquet 的数值列只能为空，并打印提示。
+    """
+    if column + DECIMALS_SUFFIX in df.columns:
+        values = df[column].tolist()
+        places = df[column + DECIMALS_SUFFIX].tolist()
+    else:
+        values, formats = numeric_column(df[column])
+        places = [-1 if fmt is None else len(fmt) - 2 if '.' in fmt else 0 for fmt in formats]
+    if as_text:
+        return [v if isinstance(v, str) else format(v, f'.{p}f') if p >= 0 and v == v else ''
+                for v, p in zip(values, places)]
+    texts = [v for v in values if isinstance(v, str) and v]
+    if texts:
+        print(f"{column} 列中的 {len(texts)} 个值不是数字，Parquet 中写为空：{texts[:3]}")
+    return [float(v) if p >= 0 and not isinstance(v, str) and v == v else float('nan')
+            for v, p in zip(values, places)]
+
+
+def write_csv_file(path, selected_invoices, with_source, progress=None, cancel_event=None):
+    """流式写入 UTF-8 BOM 编码的CSV：每张发票转换后立即写出"""
+    total_rows = sum(len(df) for _, df, _ in selected_invoices)
+    written = 0
+    with stage('write_rows'), open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        invoices = export_columns(selected_invoices, with_source, True)
+        writer.writerow(next(invoices))
+        for name, data in invoices:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled()
+            writer.writerows(zip(*data))
+            written += len(data[0])
+            if progress is not None:
+                progress(written, total_rows, name)
+
+
+def write_parquet_file(path, selected_invoices, with_source, progress=None, cancel_event=None):
+    """流式写入Parquet：每张发票一个 row group，序号为 int64，数值列为 float64，其余为字符串"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("导出 Parquet 需要安装 pyarrow（pip install pyarrow）") from e
+    total_rows = sum(len(df) for _, df, _ in selected_invoices)
+    written = 0
+    invoices = export_columns(selected_invoices, with_source, False)
+    columns = next(invoices)
+    schema = pa.schema([(column, pa.int64() if column == '序号' else
+                         pa.float64() if column in NUMERIC_DETAIL_COLUMNS else pa.string())
+                        for column in columns])
+    writer = pq.ParquetWriter(path, schema)
+    try:
+        with stage('write_rows'):
+            for name, data in invoices:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                writer.write_table(pa.table(data, schema=schema))
+                written += len(data[0])
+                if progress is not None:
+                    progress(written, total_rows, name)
+    finally:
+        with stage('save'):
+            writer.close()
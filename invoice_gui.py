@@ -0,0 +1,853 @@
+# -*- coding: utf-8 -*-
+"""
+发票明细导出Excel工具的 tkinter 界面：InvoiceApp 在 InvoiceProcessor 的基础上提供文件列表、导入/导出进度和文件夹监控。
+
+解析和命令行模式在 DigitalInvoice2EXCEL 中，进程池的子进程不会导入本模块（也就不会加载 tkinter）。
+"""
+
+import os
+import queue
+import subprocess  # 用于非Windows系统打开文件
+import threading
+import traceback
+from datetime import datetime
+from tkinter import (
+    Tk, Frame, Button, Label, StringVar, Radiobutton, messagebox, filedialog, END, Toplevel,
+    DoubleVar
+)
+from tkinter import ttk
+from DigitalInvoice2EXCEL import (
+    CONFIG_FILE, CONFIG_LIST_SEP, STATUS_TEXT, WATCH_INTERVAL, DetailStore, FileDiscovery, FolderWatcher,
+    InvoiceProcessor, InvoiceRegistry, archive_root, display_name, iter_pdf_files, iter_sources,
+)
+from invoice_export import EXPORT_FORMATS, ExportCancelled, export_invoices
+from invoice_perf import PerfReport, collect_timings
+
+# 导入时界面刷新间隔（毫秒）和每次刷新最多插入的行数
+UI_REFRESH_MS = 80
+UI_BATCH_ROWS = 500
+
+
+class SelectionModel:
+    """列表行的勾选状态：按行ID记录（保持列表顺序），实时维护选中数量，不从 Treeview 读取单元格"""
+
+    def __init__(self):
+        self.states = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def add(self, item, selected):
+        self.states[item] = selected
+        if selected:
+            self.count += 1
+
+    def remove(self, item):
+        if self.states.pop(item, False):
+            self.count -= 1
+
+    def is_selected(self, item):
+        return self.states.get(item, False)
+
+    def set(self, item, selected):
+        """设置单行状态，状态确有变化时返回 True"""
+        if item not in self.states or self.states[item] == selected:
+            return False
+        self.states[item] = selected
+        self.count += 1 if selected else -1
+        return True
+
+    def set_all(self, selected):
+        """设置全部行状态，返回状态发生变化的行ID列表"""
+        changed = [item for item, state in self.states.items() if state != selected]
+        for item in changed:
+            self.states[item] = selected
+        self.count = len(self.states) if selected else 0
+        return changed
+
+    def invert(self):
+        for item, state in self.states.items():
+            self.states[item] = not state
+        self.count = len(self.states) - self.count
+        return list(self.states)
+
+    def all_selected(self):
+        return bool(self.states) and self.count == len(self.states)
+
+    def selected_items(self):
+        return [item for item, state in self.states.items() if state]
+
+    def first_index(self, items):
+        """items 中最靠前的一行在列表中的位置"""
+        items = set(items)
+        for idx, item in enumerate(self.states):
+            if item in items:
+                return idx
+        return len(self.states)
+
+
+class InvoiceApp(InvoiceProcessor):
+
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Invoice2EXCEL V4.2")
+        InvoiceProcessor.__init__(self)
+        # 界面中的发票可能长期累积，明细落盘，内存中只保留列名和行数
+        try:
+            self.invoices = InvoiceRegistry(DetailStore())
+        except Exception as e:
+            print(f"明细磁盘存储不可用: {e}")
+
+        # 固定窗口大小为 1139x837
+        fixed_width = 1139
+        fixed_height = 837
+        self.root.geometry(f"{fixed_width}x{fixed_height}")
+
+        # 禁止调整窗口大小
+        self.root.resizable(False, False)
+
+        # 恢复上次窗口位置
+        try:
+            geom = self.config.get('window', 'position', fallback=None)
+            if geom:
+                if '+' in geom:
+                    pos_part = geom
+                    if '+' in pos_part[1:]:
+                        x, y = pos_part.split('+', 2)[1:]
+                        if x.lstrip('-').isdigit() and y.lstrip('-').isdigit():
+                            self.root.geometry(f"+{x}+{y}")
+        except:
+            pass
+
+        self.export_mode = StringVar(value=self.config.get('settings', 'export_mode', fallback="merge"))
+        self.export_format = StringVar(value=self.config.get('settings', 'export_format', fallback="xlsx"))
+        self.all_var = StringVar(value=self.config.get('settings', 'all_selected', fallback="1"))
+        self.loading_dialog = None
+        self.progress_var = None
+        self.progress_label = None
+        self.progress_bar = None
+        # 导入线程只往队列里放界面更新，由主线程定时批量取出处理
+        self.ui_queue = queue.Queue()
+        self.selection = SelectionModel()
+        # 同一时间只允许一批导入（手动添加或监控文件夹）
+        self.importing = False
+        # 导出线程读取明细期间不能删除行，监控到的变化推迟到导出结束后处理
+        self.exporting = False
+        self.deferred_watch_changes = None
+        self.watcher = None
+        self.watch_job = None
+        self.build_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.tree.bind('<Button-1>', self.on_check_click)
+        self.tree.tag_configure('success', background='#e6f3ff')
+        self.root.update_idletasks()
+        self.root.after(100, self.force_column_widths)
+
+    def force_column_widths(self):
+        self.tree.column('check', width=60)
+        self.tree.column('num', width=80)
+        self.tree.column('file', width=800)
+        self.tree.column('rows', width=150)
+        self.root.update_idletasks()
+
+    def save_config(self):
+        try:
+            if 'settings' not in self.config:
+                self.config.add_section('settings')
+            if 'window' not in self.config:
+                self.config.add_section('window')
+            if 'cache' not in self.config:
+                self.config.add_section('cache')
+
+            self.config['settings']['save_path'] = self.save_path
+            self.config['settings']['export_mode'] = self.export_mode.get()
+            self.config['settings']['export_format'] = self.export_format.get()
+            self.config['settings']['all_selected'] = self.all_var.get()
+            self.config['settings']['workers'] = str(self.workers)
+            self.config['cache']['enabled'] = self.config.get('cache', 'enabled', fallback='1')
+            self.config['cache']['max_mb'] = self.config.get('cache', 'max_mb', fallback='256')
+            self.config['settings']['include'] = CONFIG_LIST_SEP.join(self.include)
+            self.config['settings']['exclude'] = CONFIG_LIST_SEP.join(self.exclude)
+            if 'watch' in self.config:
+                self.config['watch']['interval'] = self.config.get('watch', 'interval', fallback=str(WATCH_INTERVAL))
+
+            # 保存窗口位置
+            current_geom = self.root.geometry()
+            if '+' in current_geom:
+                pos_part = '+' + current_geom.split('+', 1)[1]
+                self.config['window']['position'] = pos_part
+
+            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+                self.config.write(f)
+        except Exception as e:
+            print(f"保存配置失败: {e}")
+
+    def on_closing(self):
+        self.save_config()
+        self.stop_watch()
+        if self.cache is not None:
+            self.cache.close()
+        if self.index is not None:
+            self.index.close()
+        self.invoices.close()
+        self.root.destroy()
+
+    def build_ui(self):
+        top_frame = Frame(self.root, bg='#f0f0f0', pady=10)
+        top_frame.pack(fill='x', padx=10, pady=5)
+
+        btn_width = 12
+        Button(top_frame, text="添加发票", command=self.add_files, width=btn_width, height=1,
+               font=('微软雅黑', 10), bg='#4a90e2', fg='white').pack(side='left', padx=5)
+        Button(top_frame, text="添加文件夹", command=self.add_folder, width=btn_width, height=1,
+               font=('微软雅黑', 10), bg='#4a90e2', fg='white').pack(side='left', padx=5)
+        self.watch_button = Button(top_frame, text="监控文件夹", command=self.toggle_watch, width=btn_width, height=1,
+                                   font=('微软雅黑', 10), bg='#4a90e2', fg='white')
+        self.watch_button.pack(side='left', padx=5)
+        Label(top_frame, text="支持多选、多页电子发票PDF、OFD和XML文件", font=('微软雅黑', 10), bg='#f0f0f0').pack(side='left', padx=10)
+
+        mid_frame = Frame(self.root)
+        mid_frame.pack(fill='both', expand=True, padx=10, pady=(0, 5))
+
+        header_frame = Frame(mid_frame)
+        header_frame.pack(fill='x')
+        Label(header_frame, text="已添加的发票列表",
+              font=('微软雅黑', 9)).pack(anchor='w', padx=5)
+
+        tree_container = Frame(mid_frame)
+        tree_container.pack(fill='both', expand=True)
+
+        columns = ('check', 'num', 'file', 'rows')
+        self.tree = ttk.Treeview(tree_container, columns=columns, show='headings', selectmode='extended')
+
+        vsb = ttk.Scrollbar(tree_container, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=vsb.set)
+
+        self.tree.heading('check', text='✓')
+        self.tree.heading('num', text='序号')
+        self.tree.heading('file', text='发票文件')
+        self.tree.heading('rows', text='明细行数')
+
+        self.tree.column('check', width=60, anchor='center')
+        self.tree.column('num', width=80, anchor='center')
+        self.tree.column('file', width=800, anchor='w')
+        self.tree.column('rows', width=150, anchor='center')
+
+        self.tree.pack(side='left', fill='both', expand=True)
+        vsb.pack(side='right', fill='y')
+
+        style = ttk.Style()
+        style.theme_use('clam')
+        style.configure('Treeview.Heading',
+                        background='#e0e0e0',
+                        foreground='black',
+                        relief='raised',
+                        font=('微软雅黑', 10, 'bold'),
+                        padding=8)
+        style.map('Treeview.Heading',
+                  background=[('active', '#d0d0d0')],
+                  relief=[('pressed', '!disabled', 'sunken')])
+
+        self.selected_count_frame = Frame(self.root)
+        self.selected_count_frame.pack(fill='x', padx=10, pady=(0, 5))
+        self.selected_count_label = Label(self.selected_count_frame, text="已有 0 条符合条件的发票文件被选中",
+                                          font=('微软雅黑', 9), fg='gray', anchor='w')
+        self.selected_count_label.pack(side='left')
+
+        ctrl_frame = Frame(self.root)
+        ctrl_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Checkbutton(ctrl_frame, text="全选", variable=self.all_var,
+                        command=self.toggle_all).pack(side='left', padx=5)
+        Button(ctrl_frame, text="反选", command=self.invert_selection,
+               width=8, bg='#f39c12', fg='white').pack(side='left', padx=5)
+        Button(ctrl_frame, text="删除选中", command=self.delete_selected,
+               width=12, bg='#e74c3c', fg='white').pack(side='left', padx=10)
+        Button(ctrl_frame, text="清空解析缓存", command=self.clear_parse_cache,
+               width=12).pack(side='left', padx=5)
+        Button(ctrl_frame, text="清空导出记录", command=self.clear_export_index,
+               width=12).pack(side='left', padx=5)
+
+        bottom_frame = Frame(self.root, pady=10)
+        bottom_frame.pack(fill='x', padx=10)
+
+        left_frame = Frame(bottom_frame)
+        left_frame.pack(side='left', fill='y', padx=10)
+        Label(left_frame, text="导出选项:", font=('微软雅黑', 10, 'bold')).pack(anchor='w')
+        mode_frame = Frame(left_frame)
+        mode_frame.pack(anchor='w', pady=5)
+        Radiobutton(mode_frame, text="合并导出（所有发票合并到一个SHEET）",
+                    variable=self.export_mode, value="merge",
+                    font=('微软雅黑', 9)).pack(anchor='w')
+        Radiobutton(mode_frame, text="分表导出（每张发票单独一个SHEET，CSV/Parquet为单独文件）",
+                    variable=self.export_mode, value="separate",
+                    font=('微软雅黑', 9)).pack(anchor='w', pady=2)
+        format_frame = Frame(left_frame)
+        format_frame.pack(anchor='w')
+        for text, value in (("Excel", "xlsx"), ("CSV", "csv"), ("Parquet", "parquet")):
+            Radiobutton(format_frame, text=text, variable=self.export_format, value=value,
+                        font=('微软雅黑', 9)).pack(side='left')
+
+        middle_frame = Frame(bottom_frame)
+        middle_frame.pack(side='left', fill='both', expand=True, padx=20)
+        Label(middle_frame, text="保存路径:", font=('微软雅黑', 10, 'bold')).pack(anchor='w')
+        path_btn_frame = Frame(middle_frame)
+        path_btn_frame.pack(anchor='w', pady=5)
+        Button(path_btn_frame, text="浏览...", command=self.set_save_path,
+               width=10).pack(side='left')
+        Button(path_btn_frame, text="打开文件夹", command=self.open_save_folder,
+               width=10).pack(side='left', padx=5)
+        path_text = self.shorten_path(self.save_path)
+        self.path_label = Label(middle_frame, text=path_text,
+                                fg='blue', font=('微软雅黑', 9),
+                                wraplength=400, justify='left', anchor='w')
+        self.path_label.pack(anchor='w', pady=2)
+
+        right_frame = Frame(bottom_frame)
+        right_frame.pack(side='right', padx=10)
+        Button(right_frame, text="导出明细", command=self.export_to_excel,
+               width=btn_width, height=1, font=('微软雅黑', 10),
+               bg='#27ae60', fg='white').pack()
+
+        current_year = datetime.now().year
+        copyright_text = f"Developed by Nero Diao ©2026-{current_year}"
+        copyright_label = Label(self.root, text=copyright_text,
+                                font=('微软雅黑', 8), fg='#888888', anchor='w')
+        copyright_label.pack(side='bottom', fill='x', padx=15, pady=(0, 8))
+
+    def shorten_path(self, p):
+        p = os.path.normpath(p)
+        if len(p) <= 50:
+            return p
+        return "..." + p[-47:]
+
+    def set_check_marks(self, items):
+        """只把状态变化的行写回 Treeview"""
+        for item in items:
+            self.tree.set(item, 'check', '✓' if self.selection.is_selected(item) else '☐')
+
+    def invert_selection(self):
+        self.set_check_marks(self.selection.invert())
+        self.update_selected_count()
+
+    def on_check_click(self, event):
+        region = self.tree.identify_region(event.x, event.y)
+        if region != "cell":
+            return
+        col = self.tree.identify_column(event.x)
+        item = self.tree.identify_row(event.y)
+        if not item or col != '#1':
+            return
+        if self.selection.set(item, not self.selection.is_selected(item)):
+            self.set_check_marks((item,))
+        self.update_all_var()
+        self.update_selected_count()
+
+    def toggle_all(self):
+        self.set_check_marks(self.selection.set_all(self.all_var.get() == "1"))
+        self.update_selected_count()
+
+    def update_all_var(self):
+        self.all_var.set("1" if self.selection.all_selected() else "0")
+
+    def update_selected_count(self):
+        selected_count = self.selection.count
+        self.selected_count_label.config(text=f"已有 {selected_count} 条符合条件的发票文件被选中")
+
+    def create_progress_dialog(self, total_files, title="发票导入中", message="正在导入并解析发票文件，请稍候...",
+                               on_cancel=None):
+        self.loading_dialog = Toplevel(self.root)
+        self.loading_dialog.title(title)
+        self.loading_dialog.transient(self.root)
+        self.loading_dialog.grab_set()
+        self.loading_dialog.resizable(False, False)
+        self.loading_dialog.configure(bg='#f8f9fa')
+        dialog_width = 420
+        dialog_height = 180 if on_cancel is None else 230
+        self.root.update_idletasks()
+        root_x = self.root.winfo_x()
+        root_y = self.root.winfo_y()
+        root_width = self.root.winfo_width()
+        root_height = self.root.winfo_height()
+        pos_x = root_x + (root_width - dialog_width) // 2
+        pos_y = root_y + (root_height - dialog_height) // 2
+        self.loading_dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
+        main_frame = Frame(self.loading_dialog, bg='#f8f9fa', padx=30, pady=30)
+        main_frame.pack(fill='both', expand=True)
+        Label(main_frame, text=message,
+              font=('微软雅黑', 11, 'bold'), bg='#f8f9fa', fg='#333333').pack(pady=(0, 20))
+        self.progress_label = Label(main_frame, text=f"当前正在处理第 1 条 / 共 {total_files} 条",
+                                    font=('微软雅黑', 12), bg='#f8f9fa', fg='#2c3e50')
+        self.progress_label.pack(pady=(0, 20))
+        self.progress_var = DoubleVar()
+        style = ttk.Style()
+        style.theme_use('clam')
+        style.configure("Blue.Horizontal.TProgressbar",
+                        background='#4a90e2',
+                        troughcolor='#e0e0e0',
+                        borderwidth=0,
+                        lightcolor='#4a90e2',
+                        darkcolor='#4a90e2',
+                        thickness=24)
+        self.progress_bar = ttk.Progressbar(main_frame, variable=self.progress_var, maximum=max(total_files, 1),
+                                            style="Blue.Horizontal.TProgressbar", length=360)
+        self.progress_bar.pack(pady=(0, 10))
+        if on_cancel is not None:
+            cancel_btn = Button(main_frame, text="取消", width=10)
+
+            def cancel():
+                cancel_btn.config(state='disabled')
+                self.progress_label.config(text="正在取消...")
+                on_cancel()
+            cancel_btn.config(command=cancel)
+            cancel_btn.pack()
+            self.loading_dialog.protocol("WM_DELETE_WINDOW", cancel)
+
+    def update_progress(self, current, total, text=None):
+        if self.progress_bar is not None:
+            # 边查找边导入时总数还在增长
+            self.progress_bar.config(maximum=max(total, 1))
+        if self.progress_var is not None:
+            self.progress_var.set(current)
+        if self.progress_label is not None:
+            self.progress_label.config(text=text or f"当前正在处理第 {current} 条 / 共 {total} 条")
+
+    def safe_close_loading_dialog(self):
+        if self.loading_dialog and self.loading_dialog.winfo_exists():
+            self.loading_dialog.destroy()
+        self.loading_dialog = None
+        self.progress_var = None
+        self.progress_label = None
+        self.progress_bar = None
+
+    def add_folder(self):
+        folder = filedialog.askdirectory(title="选择包含发票的文件夹（含子文件夹）")
+        if not folder:
+            return
+        # 子文件夹边查找边导入，不等全部枚举完
+        self.start_import(FileDiscovery(iter_sources(iter_pdf_files(folder, self.include, self.exclude),
+                                                     self.include, self.exclude)))
+
+    def add_files(self):
+        files = filedialog.askopenfilenames(
+            title="选择发票文件（可多选，支持多页PDF、OFD、XML和ZIP包）",
+            filetypes=[("电子发票", "*.pdf *.ofd *.xml *.zip"), ("PDF文件", "*.pdf"), ("OFD文件", "*.ofd"),
+                       ("XML文件", "*.xml"), ("ZIP压缩包", "*.zip"), ("所有文件", "*.*")]
+        )
+        if files:
+            self.start_import(list(files))
+
+    def start_import(self, files):
+        if self.importing:
+            messagebox.showinfo("提示", "上一批发票仍在导入，请稍候再试")
+            return
+        self.importing = True
+        files = self.expand_archives(files)
+        self.create_progress_dialog(len(files) if isinstance(files, list) else 0)
+        threading.Thread(target=self.process_files, args=(files,), daemon=True).start()
+        self.root.after(UI_REFRESH_MS, self.drain_ui_queue)
+
+    def toggle_watch(self):
+        if self.watcher is not None:
+            self.stop_watch()
+            return
+        folders = [f for f in self.config.get('watch', 'folders', fallback='').split(CONFIG_LIST_SEP) if f]
+        if not folders or not messagebox.askyesno(
+                "监控文件夹", "继续监控以下文件夹？\n\n" + "\n".join(folders) + "\n\n选择“否”重新选择文件夹"):
+            folder = filedialog.askdirectory(title="选择要监控的发票文件夹（含子文件夹）")
+            if not folder:
+                return
+            folders = [folder]
+            if 'watch' not in self.config:
+                self.config.add_section('watch')
+            self.config['watch']['folders'] = CONFIG_LIST_SEP.join(folders)
+        self.watcher = FolderWatcher(folders, self.invoices.by_path, self.include, self.exclude)
+        self.watch_button.config(text="停止监控", bg='#e74c3c')
+        self.watch_tick()
+
+    def stop_watch(self):
+        self.watcher = None
+        if self.watch_job is not None:
+            self.root.after_cancel(self.watch_job)
+            self.watch_job = None
+        self.watch_button.config(text="监控文件夹", bg='#4a90e2')
+
+    def watch_tick(self):
+        """定时轮询监控文件夹；正在导入或导出时跳过本次，扫描在后台线程进行"""
+        try:
+            interval = max(1, self.config.getint('watch', 'interval', fallback=WATCH_INTERVAL))
+        except ValueError:
+            interval = WATCH_INTERVAL
+        self.watch_job = self.root.after(interval * 1000, self.watch_tick)
+        if self.importing or self.exporting:
+            return
+        self.importing = True
+        watcher = self.watcher
+
+        def poll_thread():
+            changed, deleted = [], []
+            try:
+                changed, deleted = watcher.poll()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                # 轮询出错时也要回到界面线程结束导入状态
+                self.root.after(0, self.apply_watch_changes, watcher, changed, deleted)
+        threading.Thread(target=poll_thread, daemon=True).start()
+
+    def apply_watch_changes(self, watcher, changed, deleted):
+        """删除已消失或已修改文件对应的行，再在后台导入新增和修改的文件，不弹出进度和结果窗口"""
+        if watcher is not self.watcher:
+            self.importing = False
+            return
+        if self.exporting:
+            # 轮询期间开始了导出：保持导入状态，导出结束后再删除行、导入变化的文件
+            self.deferred_watch_changes = (watcher, changed, deleted)
+            return
+        # ZIP包有变化时包中所有发票一起删除、重新导入
+        by_path = {}
+        for path, record in self.invoices.by_path.items():
+            by_path.setdefault(os.path.normpath(archive_root(path)), []).append(record)
+        stale = [record.item for path in changed + deleted for record in by_path.get(path, ())
+                 if record.item is not None]
+        if stale:
+            self.remove_rows(stale)
+            self.update_all_var()
+            self.update_selected_count()
+        if not changed:
+            self.importing = False
+            return
+        threading.Thread(target=self.process_files, args=(self.expand_archives(changed), False),
+                         daemon=True).start()
+        self.root.after(UI_REFRESH_MS, self.drain_ui_queue)
+
+    def process_files(self, files, notify=True):
+        """files 为文件列表或 FileDiscovery；后者在枚举结束前以已发现的文件数作为总数
+
+        出错时（例如明细写入磁盘失败）也一定发送 done 并附带错误信息，界面据此关闭进度窗口、结束导入状态。
+        """
+        added = 0
+        failed = 0
+        done = 0
+        error = None
+        results = {}
+        next_idx = 0
+        parse_results = self.iter_parse_results(files)
+        try:
+            for idx, path, status, df, content_hash, invoice_key in parse_results:
+                done += 1
+                if isinstance(files, FileDiscovery) and not files.finished:
+                    self.ui_queue.put(('progress', done, files.found,
+                                       f"当前正在处理第 {done} 条 / 已发现 {files.found} 条，仍在查找..."))
+                else:
+                    self.ui_queue.put(('progress', done, len(files) if isinstance(files, list) else files.found))
+                results[idx] = (path, status, df, content_hash, invoice_key)
+                # 结果按完成顺序返回，按输入顺序写入列表
+                while next_idx in results:
+                    if self.add_parse_result(*results.pop(next_idx)):
+                        added += 1
+                    else:
+                        failed += 1
+                    next_idx += 1
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e) or type(e).__name__
+        finally:
+            # 提前结束时关闭进程池
+            parse_results.close()
+            self.ui_queue.put(('progress', done, done))
+            summary = self.last_report.summary() if self.last_report is not None else None
+            self.ui_queue.put(('done', added, failed, notify, summary, error))
+
+    def drain_ui_queue(self):
+        """主线程定时取出导入线程的界面更新：批量插入行、增量编号，每次只刷新一次进度"""
+        seq = len(self.selection)
+        inserted = 0
+        progress = None
+        finished = None
+        while inserted < UI_BATCH_ROWS:
+            try:
+                msg = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if kind == 'progress':
+                progress = msg[1:]
+            elif kind == 'invoice':
+                seq += 1
+                record = msg[1]
+                item = self.tree.insert('', END, values=('✓', seq, record.name, len(record.df)), tags=('success',))
+                self.invoices.bind_item(record, item)
+                self.selection.add(item, True)
+                inserted += 1
+            elif kind == 'failed':
+                seq += 1
+                item = self.tree.insert('', END, values=('☐', seq, msg[1], msg[2]))
+                self.selection.add(item, False)
+                inserted += 1
+            elif kind == 'done':
+                finished = msg[1:]
+                break
+        if progress is not None:
+            self.update_progress(*progress)
+        if finished is None:
+            self.root.after(UI_REFRESH_MS, self.drain_ui_queue)
+            return
+
+        added, failed, notify, summary, error = finished
+        self.importing = False
+        if error is not None:
+            self.update_all_var()
+            self.update_selected_count()
+            if notify:
+                self.safe_close_loading_dialog()
+                messagebox.showerror("导入失败", f"导入过程中发生错误，已导入 {added} 张发票：\n{error}")
+            else:
+                # 监控导入出错时停止监控，避免每次轮询都重复出错
+                self.stop_watch()
+                messagebox.showerror("监控已停止", f"导入监控文件夹中的发票时发生错误：\n{error}")
+            return
+        if not notify:
+            self.update_all_var()
+            self.update_selected_count()
+            return
+        self.update_selected_count()
+        self.safe_close_loading_dialog()
+        if added > 0 or failed > 0:
+            self.show_result_dialog(added, failed, summary)
+        else:
+            messagebox.showinfo("提示", "所选文件夹中未找到发票文件")
+        if failed == 0 and added > 0:
+            self.all_var.set("1")
+            self.toggle_all()
+        else:
+            self.all_var.set("0")
+
+    def clear_parse_cache(self):
+        if self.cache is None:
+            messagebox.showinfo("提示", "解析缓存未启用")
+            return
+        if not messagebox.askyesno("确认清空", "确定要清空全部解析缓存吗？\n之后导入的发票将重新解析"):
+            return
+        count = self.cache.clear()
+        messagebox.showinfo("清空完成", f"已清空 {count} 条解析缓存")
+
+    def clear_export_index(self):
+        if self.index is None:
+            messagebox.showinfo("提示", "导出记录未启用")
+            return
+        if not messagebox.askyesno("确认清空", "确定要清空全部导出记录吗？\n之后已导出过的发票可以再次导入"):
+            return
+        count = self.index.clear()
+        messagebox.showinfo("清空完成", f"已清空 {count} 条导出记录")
+
+    def add_parse_result(self, path, status, df, content_hash=None, invoice_key=None):
+        """把单个文件的解析结果写入发票列表和界面，成功返回 True"""
+        if status == 'parsed' and df is not None and not df.empty:
+            record = self.invoices.add(path, df, display_name(path), content_hash, invoice_key)
+            self.ui_queue.put(('invoice', record))
+            return True
+        self.ui_queue.put(('failed', display_name(path), STATUS_TEXT.get(status, "0")))
+        return False
+
+    def show_result_dialog(self, added, failed, summary=None):
+        dialog = Toplevel(self.root)
+        dialog.title("处理结果")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.resizable(False, False)
+        dialog_width = 360 if not summary else 420
+        dialog_height = 160 if not summary else 230
+        self.root.update_idletasks()
+        root_x = self.root.winfo_x()
+        root_y = self.root.winfo_y()
+        root_width = self.root.winfo_width()
+        root_height = self.root.winfo_height()
+        pos_x = root_x + (root_width - dialog_width) // 2
+        pos_y = root_y + (root_height - dialog_height) // 2
+        dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
+        frame = Frame(dialog, padx=20, pady=20)
+        frame.pack(fill='both', expand=True)
+        Label(frame, text=f"处理完成：成功 {added} 个，失败/未识别 {failed} 个\n\n"
+                         f"成功识别的发票已自动勾选",
+              font=('微软雅黑', 10), justify='left').pack()
+        if summary:
+            Label(frame, text=summary, font=('微软雅黑', 8), fg='gray', justify='left').pack(pady=(8, 0))
+        Button(frame, text="确定", width=10, command=dialog.destroy).pack(pady=10)
+
+    def renumber_treeview(self, start=0):
+        """从第 start 行起重写序号列，之前的行序号不变"""
+        for i, item in enumerate(list(self.selection.states)[start:], start + 1):
+            self.tree.set(item, 'num', i)
+
+    def remove_rows(self, items):
+        """从列表、勾选状态和发票索引中删除这些行，并从第一处删除位置起重新编号"""
+        first = self.selection.first_index(items)
+        self.tree.delete(*items)
+        for item in items:
+            self.selection.remove(item)
+            record = self.invoices.by_item.get(item)
+            if record is not None:
+                self.invoices.remove(record)
+        self.renumber_treeview(first)
+
+    def delete_selected(self):
+        selected = self.selection.selected_items()
+        if not selected:
+            messagebox.showinfo("提示", "未选中任何发票")
+            return
+        if not messagebox.askyesno("确认删除", f"确定要删除选中的 {len(selected)} 张发票吗？"):
+            return
+        self.remove_rows(selected)
+        self.update_all_var()
+        self.update_selected_count()
+        messagebox.showinfo("删除完成", f"已删除 {len(selected)} 张发票")
+
+    def export_to_excel(self):
+        selected_items = self.selection.selected_items()
+        if not selected_items:
+            messagebox.showwarning("未选择", "请至少勾选一张发票进行导出")
+            return
+
+        records = [self.invoices.by_item[item] for item in selected_items if item in self.invoices.by_item]
+        selected_invoices = [(record.path, record.df, record.name) for record in records]
+
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        fmt = self.export_format.get() if self.export_format.get() in EXPORT_FORMATS else "xlsx"
+        full_path = os.path.join(self.save_path, f"发票明细_{ts}.{fmt}")
+
+        total_rows = sum(len(inv[1]) for inv in selected_invoices)
+        mode = self.export_mode.get()
+        cancel_event = threading.Event()
+        self.exporting = True
+        self.create_progress_dialog(max(total_rows, 1), title="导出中", message="正在导出发票明细，请稍候...",
+                                    on_cancel=cancel_event.set)
+        self.progress_label.config(text=f"共 {total_rows} 行明细待写入")
+
+        def on_progress(done, total, sheet_name):
+            if cancel_event.is_set():
+                return
+            if sheet_name is None:
+                text = "正在保存文件..."
+            else:
+                text = f"{sheet_name}：已写入 {done} / {total} 行"
+            self.root.after(0, self.update_progress, done, total, text)
+
+        def export_thread():
+            report = PerfReport('export')
+            try:
+                with collect_timings() as stats:
+                    out_path = export_invoices(full_path, selected_invoices, mode, fmt, on_progress, cancel_event)
+            except ExportCancelled:
+                self.root.after(0, self.safe_close_loading_dialog)
+                self.root.after(0, lambda: messagebox.showinfo("已取消", "导出已取消，未生成文件"))
+                return
+            except Exception as e:
+                traceback.print_exc()
+                self.root.after(0, self.safe_close_loading_dialog)
+                self.root.after(0, lambda e=e: messagebox.showerror("导出失败", f"导出过程中发生错误：\n{str(e)}"))
+                return
+            finally:
+                self.root.after(0, self.finish_export)
+            report.add(out_path, mode, total_rows, stats)
+            report.finish()
+            report.write(self.perf_log)
+            self.record_exported(records, out_path)
+            self.root.after(0, self.safe_close_loading_dialog)
+            self.root.after(0, self.show_export_success, len(selected_invoices), os.path.basename(out_path),
+                            out_path, report.summary())
+        threading.Thread(target=export_thread, daemon=True).start()
+
+    def finish_export(self):
+        """导出线程结束（成功、失败或取消）后在主线程调用，处理导出期间推迟的监控变化"""
+        self.exporting = False
+        deferred, self.deferred_watch_changes = self.deferred_watch_changes, None
+        if deferred is not None:
+            self.apply_watch_changes(*deferred)
+
+    def show_export_success(self, invoice_count, filename, full_path, summary=None):
+        # 导出成功弹窗
+        dialog = Toplevel(self.root)
+        dialog.title("导出成功！")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.resizable(False, False)
+        dialog_width = 420
+        dialog_height = 180 if not summary else 240
+        self.root.update_idletasks()
+        root_x = self.root.winfo_x()
+        root_y = self.root.winfo_y()
+        root_width = self.root.winfo_width()
+        root_height = self.root.winfo_height()
+        pos_x = root_x + (root_width - dialog_width) // 2
+        pos_y = root_y + (root_height - dialog_height) // 2
+        dialog.geometry(f"{dialog_width}x{dialog_height}+{pos_x}+{pos_y}")
+
+        msg_frame = Frame(dialog, padx=30, pady=20)
+        msg_frame.pack(fill='both', expand=True)
+
+        Label(msg_frame,
+              text=f"成功导出 {invoice_count} 张发票明细\n\n"
+                   f"文件：{filename}\n"
+                   f"路径：{os.path.normpath(self.save_path)}",
+              font=('微软雅黑', 10), justify='left').pack(anchor='w')
+        if summary:
+            Label(msg_frame, text=summary, font=('微软雅黑', 8), fg='gray', justify='left').pack(anchor='w', pady=(8, 0))
+
+        btn_frame = Frame(dialog)
+        btn_frame.pack(pady=(10, 20))
+
+        def close_dialog():
+            dialog.destroy()
+
+        # 打开所在文件夹（立即关闭）
+        Button(btn_frame, text="打开所在文件夹",
+               font=('微软雅黑', 10),
+               width=14,
+               command=lambda: [self.open_save_folder(), close_dialog()]).pack(side='left', padx=8)
+
+        # 打开文件：异步打开，点击后立即关闭窗口
+        def open_file_async():
+            def target():
+                try:
+                    if os.name == 'nt':
+                        os.startfile(full_path)
+                    else:
+                        subprocess.call(['xdg-open', full_path])
+                except Exception:
+                    pass
+            threading.Thread(target=target, daemon=True).start()
+
+        Button(btn_frame, text="打开文件",
+               font=('微软雅黑', 10),
+               width=10,
+               command=lambda: [open_file_async(), close_dialog()]).pack(side='left', padx=8)
+
+        # 关闭
+        Button(btn_frame, text="关闭",
+               font=('微软雅黑', 10),
+               width=10,
+               command=close_dialog).pack(side='left', padx=8)
+
+    def set_save_path(self):
+        p = filedialog.askdirectory(title="选择导出文件夹", initialdir=self.save_path)
+        if p:
+            self.save_path = os.path.normpath(p)
+            self.path_label.config(text=self.shorten_path(self.save_path))
+            messagebox.showinfo("成功", f"保存路径已更新为：\n{self.save_path}")
+
+    def open_save_folder(self):
+        try:
+            if os.path.exists(self.save_path):
+                if os.name == 'nt':
+                    os.startfile(self.save_path)
+                else:
+                    subprocess.call(['xdg-open', self.save_path])
+        except Exception as e:
+            messagebox.showerror("打开失败", f"无法打开文件夹：\n{str(e)}")
+
+
+def main():
+    root = Tk()
+    InvoiceApp(root)
+    root.mainloop()
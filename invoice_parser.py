@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""
+发票明细解析核心：只依赖 pdfplumber 和 pandas，不加载 tkinter / openpyxl，
+可在进程池子进程或其他服务中直接调用。各阶段耗时通过 invoice_perf.stage 记录。
+
+    from invoice_parser import parse_invoice
+    df = parse_invoice('发票.pdf')          # 也可以传入PDF的 bytes 或文件对象，以及 .ofd / .xml 发票
+"""
+
+import io
+import os
+import re
+import traceback
+from functools import lru_cache
+import numpy as np
+import pdfplumber
+import pandas as pd
+from pdfminer.pdftypes import resolve1
+from invoice_perf import collect_timings, profiled, stage
+
+# 解析规则变化时需要递增，使旧的缓存结果自动失效
+PARSER_VERSION = '4.3.3'
+DETAIL_COLUMNS = ['项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率/征收率', '税额']
+# 数值列解析后存为 float64（空值为 NaN），原文的小数位数存入“列名+DECIMALS_SUFFIX”的 int8 列，空值为 -1
+NUMERIC_DETAIL_COLUMNS = ['数量', '单价', '金额', '税额']
+DECIMALS_SUFFIX = '#小数位'
+# 取值种类很少的文本列存为 category
+CATEGORY_COLUMNS = ['单位', '税率/征收率']
+UNIT_KEYWORDS = [
+    '千克', '个', '件', '套', '台', '张', '米', '公斤', '升', '吨',
+    '箱', '盒', '包', '瓶', '罐', '条', '只', '卷', '桶', '大', '袋',
+    '块', '次', '批', '批次', '项',
+    '枚', '支', '根', '头', '辆', '架', '艘', '本', '册', '部',
+    '组', '副', '双', '对', '厘米', '毫米', '公里', '英尺', '英寸',
+    '平方米', '平方英尺', '立方米', '立方厘米', '加仑', '毫升',
+    '克', '毫克', '磅', '盎司', '小时', '天', '月', '年', '季度',
+    '份', '页', '场', '位', '人次', '立方', '平米', '度', '千瓦时', '斤', '两',
+    '㎡', 'm³', '㎏', '㎞', '千米'
+]
+
+INVOICE_NO_PATTERNS = [re.compile(p) for p in (
+    r'发票号码[：:\s]*([0-9]{8,12})',
+    r'发票代码[：:\s]*([0-9]{10,12})',
+    r'No[.:：\s]*([0-9]{8,12})',
+    r'发票号[：:\s]*([0-9]{8,12})',
+)]
+# 只判断有无发票号码时合并为一个正则，每页文本只扫描一遍
+INVOICE_NO_RE = re.compile('|'.join(f'(?:{p.pattern})' for p in INVOICE_NO_PATTERNS))
+# 用于查重的发票号码和发票代码：只认“发票号码”“发票代码”字样后的完整数字，
+# 不用 No（订单号、合同号等也可能写成 No.12345678）
+INVOICE_NUMBER_RE = re.compile(r'发票号码[：:\s]*([0-9]{8,20})(?![0-9])')
+INVOICE_CODE_RE = re.compile(r'发票代码[：:\s]*([0-9]{10,12})(?![0-9])')
+FULL_INVOICE_NUMBER_RE = re.compile(r'[0-9]{20}')
+INVOICE_CODE_FORMAT_RE = re.compile(r'[0-9]{10,12}')
+SHORT_INVOICE_NUMBER_RE = re.compile(r'[0-9]{8,12}')
+TAX_RATE_RE = re.compile(r'(\d+(?:\.\d+)?%)')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+DIGIT_RE = re.compile(r'\d')
+TOTAL_AMOUNT_RE = re.compile(r'\d{3,}')
+# 星号两侧、左括号后、右括号前的空格一次性去掉
+PUNCT_SPACE_RE = re.compile(r'\s*\*\s*|\(\s+|\s+\)')
+CJK_SPACE_RE = re.compile(r'([\u4e00-\u9fff])\s+([\u4e00-\u9fff])')
+TOTAL_KEYWORDS = ('合计', '价税合计', '小计', '总计')
+HEADER_KEYWORDS = ('项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率')
+SECTION_END_MARKS = ('税额', '¥', '￥', '备注', '开票人', '收款人')
+# ZIP包中的发票记为“压缩包路径::成员名”，嵌套的ZIP逐层相连
+ARCHIVE_SEP = '::'
+# 有单位/数量/单价/金额之一的是完整明细，否则是上一条明细的续行
+MERGE_KEY_COLUMNS = ['单位', '数量', '单价', '金额']
+# 明细行数达到该值时按列合并续行，行数少时逐行处理更快
+MERGE_VECTORIZE_MIN_ROWS = 2000
+
+
+def build_unit_index(keywords):
+    """按首字建立单位关键字索引，值为 (列表中的优先级, 单位)，匹配时仍按原列表顺序取第一个"""
+    index = {}
+    for priority, unit in enumerate(keywords):
+        index.setdefault(unit[0], []).append((priority, unit))
+    return index
+
+
+UNIT_INDEX = build_unit_index(UNIT_KEYWORDS)
+UNIT_FIRST_CHARS = frozenset(UNIT_INDEX)
+
+# 已加载或已导出的发票键，进程池初始化时通过 set_known_invoices 设置；解析到这些发票时不再提取明细
+KNOWN_INVOICES = frozenset()
+
+
+def open_pdf(source):
+    """source 可以是文件路径、PDF的 bytes 或已打开的二进制文件对象"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return pdfplumber.open(source)
+
+
+def parse_invoice(source):
+    """解析一张电子发票，返回明细 DataFrame；不是发票或未识别到明细时返回 None"""
+    status, df = parse_invoice_file(source)
+    return df if status == 'parsed' else None
+
+
+def has_invoice_number(page_texts):
+    for text in page_texts[:2]:
+        if text and INVOICE_NO_RE.search(text.upper()):
+            return True
+    return False
+
+
+def invoice_key(page_texts):
+    """前两页中的发票代码和发票号码组成的发票键，规则见 make_invoice_key"""
+    number = code = None
+    for text in page_texts[:2]:
+        if not text:
+            continue
+        if number is None:
+            match = INVOICE_NUMBER_RE.search(text)
+            number = match.group(1) if match else None
+        if code is None:
+            match = INVOICE_CODE_RE.search(text)
+            code = match.group(1) if match else None
+    return make_invoice_key(code, number)
+
+
+def make_invoice_key(code, number):
+    """只有能唯一确定一张发票时才返回发票键，否则返回 None（不参与查重）
+
+    全电发票的20位发票号码本身唯一，键为“:发票号码”；其他发票的号码只在同一发票代码下唯一，
+    需要同时有发票代码，键为“发票代码:发票号码”。
+    """
+    if not number:
+        return None
+    if FULL_INVOICE_NUMBER_RE.fullmatch(number):
+        return f":{number}"
+    if code and INVOICE_CODE_FORMAT_RE.fullmatch(code) and SHORT_INVOICE_NUMBER_RE.fullmatch(number):
+        return f"{code}:{number}"
+    return None
+
+
+def set_known_invoices(keys):
+    """进程池的 initializer：设置本进程中需要提前拒绝的发票键"""
+    global KNOWN_INVOICES
+    KNOWN_INVOICES = frozenset(keys)
+
+
+def resources_have_fonts(resources, seen=None):
+    """资源字典（含嵌套的 Form XObject）中是否引用了字体；没有字体的页面提取不出任何文字"""
+    resources = resolve1(resources)
+    if not isinstance(resources, dict):
+        return False
+    if resolve1(resources.get('Font')):
+        return True
+    seen = set() if seen is None else seen
+    xobjects = resolve1(resources.get('XObject'))
+    if not isinstance(xobjects, dict):
+        return False
+    for ref in xobjects.values():
+        if id(ref) in seen:
+            continue
+        seen.add(id(ref))
+        xobj = resolve1(ref)
+        attrs = getattr(xobj, 'attrs', {})
+        if getattr(resolve1(attrs.get('Subtype')), 'name', None) == 'Form':
+            if resources_have_fonts(attrs.get('Resources'), seen):
+                return True
+    return False
+
+
+def quick_not_invoice(pdf):
+    """不做版面分析的快速判断：没有页面，或前两页都没有字体（扫描件、纯图片）时肯定不是电子发票
+
+    只读取页面对象的资源字典，不解码内容流；返回 False 表示无法快速排除，需要提取文字再判断。
+    """
+    pages = pdf.pages[:2]
+    if not pages:
+        return True
+    return not any(resources_have_fonts(page.page_obj.resources) for page in pages)
+
+
+def parse_invoice_file(source):
+    """只打开一次PDF，每页文本只提取一次，同时用于发票号码识别和明细解析，返回 (状态, DataFrame)"""
+    return parse_invoice_source(source)[:2]
+
+
+def source_format(source):
+    """判断发票格式 pdf / ofd / xml：文件路径按扩展名，bytes 按文件头，文件对象按PDF处理"""
+    if isinstance(source, (bytes, bytearray)):
+        head = bytes(source[:16]).lstrip(b'\xef\xbb\xbf \t\r\n')
+        if head.startswith(b'PK'):
+            return 'ofd'
+        if head.startswith(b'<'):
+            return 'xml'
+        return 'pdf'
+    if isinstance(source, (str, os.PathLike)):
+        ext = os.path.splitext(source)[1].lower()
+        if ext in ('.ofd', '.xml'):
+            return ext[1:]
+    return 'pdf'
+
+
+def parse_invoice_source(source, known_invoices=()):
+    """parse_invoice_file 并返回发票键：(状态, DataFrame, 发票键)
+
+    发票键在 known_invoices 中时读完前两页即返回 duplicate，不再提取其余页和解析明细。
+    XML / OFD 发票交给 invoice_structured 直接读取明细字段。
+    """
+    fmt = source_format(source)
+    if fmt != 'pdf':
+        # invoice_structured 依赖本模块，在这里才导入
+        from invoice_structured import parse_structured_source
+        return parse_structured_source(source, fmt, known_invoices)
+    is_invoice = False
+    key = None
+    try:
+        with stage('open'):
+            pdf = open_pdf(source)
+        with pdf:
+            with stage('prefilter'):
+                if quick_not_invoice(pdf):
+                    return 'not_invoice', None, None
+            with stage('extract_text'):
+                page_texts = [page.extract_text() for page in pdf.pages[:2]]
+            if not has_invoice_number(page_texts):
+                return 'not_invoice', None, None
+            is_invoice = True
+            key = invoice_key(page_texts)
+            if key is not None and key in known_invoices:
+                return 'duplicate', None, key
+            with stage('extract_text'):
+                page_texts.extend(page.extract_text() for page in pdf.pages[2:])
+    except Exception:
+        if not is_invoice:
+            return 'not_invoice', None, None
+        # 已确认是发票但读取出错（可能是偶发错误），不能当作没有明细的发票缓存下来
+        traceback.print_exc()
+        return 'error', None, key
+    return 'parsed', extract_goods_from_texts(page_texts), key
+
+
+def parse_invoice_file_timed(source, profile_dir=None, profile_name=None, known_invoices=None):
+    """parse_invoice_source 并记录各阶段耗时，返回 (状态, DataFrame, 耗时统计, 发票键)
+
+    profile_dir 不为空时同时做 cProfile 采样，保存为 profile_dir/profile_name.prof；
+    known_invoices 为 None 时使用 set_known_invoices 设置的发票键。
+    """
+    if known_invoices is None:
+        known_invoices = KNOWN_INVOICES
+    with collect_timings() as stats, profiled(profile_dir, profile_name or 'invoice'):
+        status, df, key = parse_invoice_source(source, known_invoices)
+    return status, df, stats, key
+
+
+def extract_goods_from_texts(page_texts):
+    try:
+        all_goods_lines = []
+        with stage('find_goods_section'):
+            for full_text in page_texts:
+                if not full_text:
+                    continue
+                lines = [line.strip() for line in full_text.split('\n') if line.strip()]
+                goods_section = find_goods_section_smart(lines)
+                if goods_section:
+                    all_goods_lines.extend(goods_section)
+
+        if not all_goods_lines:
+            return None
+
+        with stage('parse_lines'):
+            parsed_data = []
+            for line in all_goods_lines:
+                if is_total_line(line):
+                    continue
+                row_data = parse_goods_line_corrected(line)
+                parsed_data.append(row_data)
+
+        if not parsed_data:
+            return None
+
+        with stage('merge_rows'):
+            df = pd.DataFrame(parsed_data)
+            for col in DETAIL_COLUMNS:
+                if col not in df.columns:
+                    df[col] = ""
+
+            df = df[DETAIL_COLUMNS]
+            df = merge_continued_rows(df)
+        with stage('clean_text'):
+            df['项目名称'] = df['项目名称'].apply(clean_chinese_text)
+            df['规格型号'] = df['规格型号'].apply(clean_chinese_text)
+            df.insert(0, '序号', range(1, len(df) + 1))
+        with stage('typed_columns'):
+            return typed_detail_columns(df)
+    except Exception as e:
+        traceback.print_exc()
+        return None
+
+
+def parse_goods_line_corrected(line):
+    row_data = {
+        '项目名称': '', '规格型号': '', '单位': '',
+        '数量': '', '单价': '', '金额': '',
+        '税率/征收率': '', '税额': ''
+    }
+
+    original_line = line
+    line = line.strip()
+    if not line:
+        return row_data
+
+    tax_rate_match = TAX_RATE_RE.search(line)
+    if tax_rate_match:
+        row_data['税率/征收率'] = tax_rate_match.group(1)
+
+    unit, unit_pos = find_unit(line)
+
+    if unit:
+        row_data['单位'] = unit
+
+    if unit and unit_pos != -1:
+        right_part = line[unit_pos + len(unit):].replace(',', '')
+        numbers_raw = NUMBER_RE.findall(right_part)
+    else:
+        line = line.replace(',', '')
+        numbers_raw = NUMBER_RE.findall(line)
+
+    numbers = numbers_raw
+
+    tax_rate_num = row_data['税率/征收率'].rstrip('%') if row_data['税率/征收率'] else None
+    if tax_rate_num and tax_rate_num in numbers:
+        numbers = numbers[::-1]
+        numbers.remove(tax_rate_num)
+        numbers = numbers[::-1]
+
+    if len(numbers) >= 4:
+        row_data['数量'] = numbers[0]
+        row_data['单价'] = numbers[1]
+        row_data['金额'] = numbers[2]
+        row_data['税额'] = numbers[3]
+    elif len(numbers) == 3:
+        row_data['数量'] = numbers[0]
+        row_data['单价'] = numbers[1]
+        row_data['金额'] = numbers[2]
+    elif len(numbers) == 2:
+        row_data['数量'] = numbers[0]
+        row_data['单价'] = numbers[1]
+    elif len(numbers) == 1:
+        row_data['金额'] = numbers[0]
+
+    left_text = original_line
+    if unit and unit_pos != -1:
+        left_text = original_line[:unit_pos].strip()
+    else:
+        if numbers_raw:
+            for num in numbers_raw:
+                pos = original_line.find(num)
+                if pos != -1:
+                    left_text = original_line[:pos].strip()
+                    break
+
+    left_text = left_text.replace('**', '')
+    if ' ' in left_text:
+        parts = left_text.split(' ')
+        if len(parts) >= 2:
+            row_data['项目名称'] = parts[0].strip()
+            row_data['规格型号'] = ' '.join(parts[1:]).strip()
+        else:
+            row_data['项目名称'] = left_text.strip()
+    else:
+        row_data['项目名称'] = left_text.strip()
+
+    return row_data
+
+
+def find_unit(line):
+    """返回 (单位, 位置)：按 UNIT_KEYWORDS 顺序取第一个前后5个字符内有数字的单位"""
+    hits = UNIT_FIRST_CHARS.intersection(line)
+    if not hits:
+        return None, -1
+    if len(hits) == 1:
+        candidates = UNIT_INDEX[next(iter(hits))]
+    else:
+        candidates = sorted(c for ch in hits for c in UNIT_INDEX[ch])
+    for _, u in candidates:
+        pos = line.find(u)
+        if pos != -1 and DIGIT_RE.search(line, max(0, pos - 5), pos + len(u) + 5):
+            return u, pos
+    return None, -1
+
+
+def merge_continued_rows(df):
+    """把没有单位/数量/单价/金额的续行合并到上一条完整明细的规格型号中
+
+    开头的不完整行作为后续续行的首行。明细行数少时逐行处理，行数多时按列计算，两种方式结果相同。
+    """
+    if df.empty:
+        return df
+    if len(df) < MERGE_VECTORIZE_MIN_ROWS:
+        return merge_continued_rows_loop(df)
+    return merge_continued_rows_vectorized(df)
+
+
+def merge_continued_rows_loop(df):
+    """逐行合并：每条完整明细开启新行，续行文字用空格拼接后追加到当前行的规格型号"""
+    columns = list(df.columns)
+    name_pos = columns.index('项目名称')
+    model_pos = columns.index('规格型号')
+    key_pos = [columns.index(name) for name in MERGE_KEY_COLUMNS]
+    merged_rows = []
+    current_row = None
+    for row in df.itertuples(index=False, name=None):
+        if any(pd.notna(row[pos]) and row[pos] != '' for pos in key_pos):
+            current_row = list(row)
+            merged_rows.append(current_row)
+        elif current_row is None:
+            current_row = list(row)
+            merged_rows.append(current_row)
+        else:
+            # 续行内容追加到规格型号（无论在项目名称还是规格型号列）
+            append_text = (str(row[name_pos]).strip() + " " + str(row[model_pos]).strip()).strip()
+            if append_text:
+                if current_row[model_pos]:
+                    current_row[model_pos] += " " + append_text
+                else:
+                    current_row[model_pos] = append_text
+    return pd.DataFrame(merged_rows, columns=columns)
+
+
+def merge_continued_rows_vectorized(df):
+    """按列合并：每条完整明细开启一组（累计求和得到组号），组内续行文字按顺序用空格拼接后追加到该组首行"""
+    has_key = df[MERGE_KEY_COLUMNS].notna() & (df[MERGE_KEY_COLUMNS] != '')
+    group = has_key.any(axis=1).cumsum().to_numpy()
+    is_first = np.empty(len(group), dtype=bool)
+    is_first[0] = True
+    is_first[1:] = group[1:] != group[:-1]
+
+    result = df[is_first].reset_index(drop=True)
+    if is_first.all():
+        return result
+
+    # 续行内容追加到规格型号（无论在项目名称还是规格型号列）
+    cont = df[~is_first]
+    cont_text = (cont['项目名称'].astype(str).str.strip() + " " +
+                 cont['规格型号'].astype(str).str.strip()).str.strip()
+    has_text = (cont_text != '').to_numpy()
+    if not has_text.any():
+        return result
+    appended = cont_text[has_text].groupby(group[~is_first][has_text]).agg(" ".join)
+
+    extra = pd.Series(group[is_first]).map(appended)
+    base = result['规格型号']
+    mask = extra.notna().to_numpy()
+    base_filled = base.astype(bool).to_numpy()
+    joined = np.where(base_filled, base.astype(str) + " " + extra, extra)
+    result['规格型号'] = np.where(mask, joined, base.to_numpy(dtype=object))
+    return result
+
+
+def typed_detail_columns(df):
+    """把文本数值列转换为 float64 + 小数位数列，低基数文本列转换为 category
+
+    每个数值列只遍历一遍原文本，值和小数位数一起得到；所有列转换好后一次性构造新的 DataFrame。
+    数值列中有无法转换为数字的文本时该列保留原文本，不生成小数位数列，导出时按文本明细处理。
+    """
+    data = {}
+    decimals = {}
+    for name in df.columns:
+        if name in NUMERIC_DETAIL_COLUMNS:
+            texts = df[name].tolist()
+            pairs = [number_and_decimals(str(text)) for text in texts]
+            if any(value is None for value, _ in pairs):
+                data[name] = np.array(texts, dtype=object)
+                continue
+            data[name] = np.array([value for value, _ in pairs], dtype='float64')
+            decimals[name + DECIMALS_SUFFIX] = np.array([places for _, places in pairs]).astype('int8')
+        elif name in CATEGORY_COLUMNS:
+            data[name] = pd.Categorical(df[name].tolist())
+        else:
+            data[name] = df[name].to_numpy()
+    data.update(decimals)
+    return pd.DataFrame(data, index=df.index)
+
+
+@lru_cache(maxsize=65536)
+def number_and_decimals(text):
+    """'1,234.50' -> (1234.5, 2)：去掉千分位逗号后转换；空文本为 (NaN, -1)，无法转换的文本值为 None"""
+    if text == '':
+        return np.nan, -1
+    try:
+        value = float(text.replace(',', ''))
+    except ValueError:
+        return None, -1
+    dot = text.find('.')
+    return value, len(text) - dot - 1 if dot >= 0 else 0
+
+
+def clean_chinese_text(text):
+    if not text:
+        return ""
+    # 与 re.sub(r'\s+', ' ', ...).strip() 等价，str.split 的空白字符集合与 \s 相同
+    cleaned = ' '.join(str(text).split())
+    if ' ' not in cleaned:
+        return cleaned
+    cleaned = PUNCT_SPACE_RE.sub(lambda m: m.group().strip(), cleaned)
+    cleaned = CJK_SPACE_RE.sub(r'\1\2', cleaned)
+    return cleaned
+
+
+def find_goods_section_smart(lines):
+    goods_section = []
+    in_goods_section = False
+
+    for line in lines:
+        if not in_goods_section:
+            if is_goods_header(line):
+                in_goods_section = True
+                continue
+
+        if in_goods_section:
+            if is_end_of_goods_section(line):
+                break
+            goods_section.append(line)
+
+    return goods_section
+
+
+def is_goods_header(line):
+    return sum(1 for kw in HEADER_KEYWORDS if kw in line) >= 2
+
+
+def is_end_of_goods_section(line):
+    if any(kw in line for kw in TOTAL_KEYWORDS):
+        if TOTAL_AMOUNT_RE.search(line.replace(',', '')):
+            return True
+
+    if any(m in line for m in SECTION_END_MARKS) and DIGIT_RE.search(line):
+        return True
+
+    return False
+
+
+def is_total_line(line):
+    if any(kw in line for kw in TOTAL_KEYWORDS):
+        if TOTAL_AMOUNT_RE.search(line.replace(',', '')):
+            return True
+    return False
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+导入/导出性能统计：按阶段累计墙钟时间和线程CPU时间，记录进程内存峰值，
+逐文件汇总后可写入 JSON Lines 或 CSV 日志，并可对单个文件做 cProfile 采样。
+
+    with collect_timings() as stats:
+        with stage('extract_text'):
+            ...
+    # stats == {'extract_text': [墙钟秒, CPU秒], 'total': [...], 'peak_mb': ...}
+"""
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# CSV 日志的固定列顺序：导入依次为计算哈希、查缓存、打开PDF、快速排除、提取文字、定位明细区、
+# 解析明细行、合并续行、清理文字、转换数值列；导出为写入明细行、保存文件
+STAGES = ('hash', 'cache', 'open', 'prefilter', 'extract_text', 'find_goods_section', 'parse_lines',
+          'merge_rows', 'clean_text', 'typed_columns', 'write_rows', 'save')
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """把代码块的耗时累加到当前线程正在收集的统计中；未在收集时几乎没有开销"""
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        yield
+        return
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        entry = stats.setdefault(name, [0.0, 0.0])
+        entry[0] += time.perf_counter() - wall
+        entry[1] += time.thread_time() - cpu
+
+
+@contextmanager
+def collect_timings():
+    """在当前线程收集各阶段耗时，结束时补上 total 和进程内存峰值 peak_mb"""
+    previous = getattr(_local, 'stats', None)
+    stats = {}
+    _local.stats = stats
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield stats
+    finally:
+        stats['total'] = [time.perf_counter() - wall, time.thread_time() - cpu]
+        stats['peak_mb'] = peak_memory_mb()
+        _local.stats = previous
+
+
+def merge_timings(stats, other):
+    """把另一段统计（例如子进程中的解析耗时）累加进 stats，内存峰值取较大者"""
+    for name, value in other.items():
+        if name == 'peak_mb':
+            if value is not None:
+                stats[name] = max(value, stats.get(name) or 0)
+            continue
+        entry = stats.setdefault(name, [0.0, 0.0])
+        entry[0] += value[0]
+        entry[1] += value[1]
+    return stats
+
+
+def peak_memory_mb():
+    """当前进程的内存峰值（MB）；无法获取时返回 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为 KB，macOS 为字节
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / (1024 * 1024), 1)
+    except Exception:
+        pass
+    return None
+
+
+@contextmanager
+def profiled(profile_dir, name):
+    """profile_dir 不为空时对代码块做 cProfile 采样，结果保存为 profile_dir/name.prof"""
+    if not profile_dir:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+        except OSError as e:
+            print(f"保存性能采样失败: {e}")
+
+
+class PerfReport:
+    """一批导入或一次导出的性能统计：逐项记录各阶段耗时，汇总后写入日志或显示在结果窗口"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.wall = time.perf_counter()
+        self.elapsed = None
+        self.records = []
+
+    def add(self, path, status, rows, stats):
+        self.records.append({'kind': self.kind, 'time': datetime.now().isoformat(timespec='seconds'),
+                             'file': path, 'status': status, 'rows': rows, 'stats': stats})
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.wall
+        return self
+
+    def stage_totals(self):
+        """{阶段: [墙钟秒, CPU秒]}，按墙钟时间从大到小排列，不含 total"""
+        totals = {}
+        for record in self.records:
+            for name, value in record['stats'].items():
+                if name in ('total', 'peak_mb'):
+                    continue
+                entry = totals.setdefault(name, [0.0, 0.0])
+                entry[0] += value[0]
+                entry[1] += value[1]
+        return dict(sorted(totals.items(), key=lambda item: -item[1][0]))
+
+    def peak_mb(self):
+        peaks = [r['stats'].get('peak_mb') for r in self.records]
+        peaks.append(peak_memory_mb())
+        peaks = [p for p in peaks if p is not None]
+        return max(peaks) if peaks else None
+
+    def summary(self, top=3):
+        """结果窗口中显示的一段文字：总耗时、各文件CPU合计、最耗时的几个阶段和内存峰值"""
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.wall
+        cpu = sum(r['stats'].get('total', (0.0, 0.0))[1] for r in self.records)
+        lines = [f"耗时 {elapsed:.1f} 秒，CPU {cpu:.1f} 秒"]
+        totals = self.stage_totals()
+        stage_wall = sum(value[0] for value in totals.values()) or 1.0
+        if totals:
+            lines.append("主要阶段：" + "，".join(f"{name} {value[0]:.1f}秒({value[0] / stage_wall:.0%})"
+                                              for name, value in list(totals.items())[:top]))
+        peak = self.peak_mb()
+        if peak is not None:
+            lines.append(f"内存峰值 {peak:.0f} MB")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """追加写入日志：.csv 结尾时每项一行、各阶段展开为列，否则写 JSON Lines"""
+        if not path or not self.records:
+            return
+        try:
+            if path.lower().endswith('.csv'):
+                self.write_csv(path)
+            else:
+                with open(path, 'a', encoding='utf-8') as f:
+                    for record in self.records:
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"写入性能日志失败: {e}")
+
+    def write_csv(self, path):
+        stages = STAGES + ('total',)
+        header = ['kind', 'time', 'file', 'status', 'rows', 'peak_mb']
+        for name in stages:
+            header += [f'{name}_wall', f'{name}_cpu']
+        new_file = not os.path.exists(path)
+        # utf-8-sig 让 Excel 直接打开时中文路径不乱码
+        with open(path, 'a', encoding='utf-8-sig' if new_file else 'utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(header)
+            for record in self.records:
+                stats = record['stats']
+                row = [record['kind'], record['time'], record['file'], record['status'], record['rows'],
+                       stats.get('peak_mb')]
+                for name in stages:
+                    wall, cpu = stats.get(name, (None, None))
+                    row += [None if wall is None else round(wall, 4), None if cpu is None else round(cpu, 4)]
+                writer.writerow(row)
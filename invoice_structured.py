@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+结构化电子发票（XML / OFD）解析：直接读取发票XML中的明细字段，不做版面分析，
+输出与PDF解析相同的明细表（序号 + DETAIL_COLUMNS，数值列为 float64 + 小数位数列）。
+
+OFD 是 zip 包：全电发票的 OFD 附带原始发票XML时直接解析该XML，
+否则按页面（含模板页）中文字对象的坐标拼成文本行，交给与PDF相同的明细识别规则。
+"""
+
+import io
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from decimal import Decimal, InvalidOperation
+import pandas as pd
+from invoice_parser import (
+    DETAIL_COLUMNS, extract_goods_from_texts, has_invoice_number, invoice_key, make_invoice_key,
+    typed_detail_columns,
+)
+from invoice_perf import stage
+
+# 明细字段在各版本发票XML中的元素名（不含命名空间）
+ITEM_FIELDS = {
+    '项目名称': ('ItemName', 'GoodsName'),
+    '规格型号': ('SpecMod', 'Specification', 'Spec'),
+    '单位': ('MeaUnits', 'MeasurementDimension', 'Unit'),
+    '数量': ('Quantity', 'Num'),
+    '单价': ('UnPrice', 'UnitPrice', 'Price'),
+    '金额': ('Amount', 'Amt'),
+    '税率/征收率': ('TaxRate', 'TaxScheme'),
+    '税额': ('ComTaxAm', 'TaxAmount', 'TaxAm'),
+}
+INVOICE_NUMBER_TAGS = ('InvoiceNumber', 'EInvoiceNumber', 'InvoiceNo')
+INVOICE_CODE_TAGS = ('InvoiceCode',)
+# OFD 坐标单位为毫米，基线相差不超过该值的文字视为同一行
+OFD_LINE_TOLERANCE = 1.0
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def read_bytes(source):
+    """source 可以是文件路径、bytes 或已打开的二进制文件对象"""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def parse_structured_source(source, fmt, known_invoices=()):
+    """解析 XML 或 OFD 发票，返回与 parse_invoice_source 相同的 (状态, DataFrame, 发票键)"""
+    try:
+        with stage('open'):
+            data = read_bytes(source)
+        if fmt == 'ofd':
+            return parse_ofd(data, known_invoices)
+        with stage('open'):
+            root = ET.fromstring(data)
+        return parse_invoice_xml(root, known_invoices)
+    except (ET.ParseError, zipfile.BadZipFile, KeyError, ValueError):
+        return 'not_invoice', None, None
+
+
+def parse_invoice_xml(root, known_invoices=()):
+    """发票XML：按元素名取发票号码、发票代码和每条明细的字段"""
+    number = find_text(root, INVOICE_NUMBER_TAGS)
+    code = find_text(root, INVOICE_CODE_TAGS)
+    with stage('parse_lines'):
+        rows = [item_row(item) for item in iter_items(root)]
+    if number is None and not rows:
+        return 'not_invoice', None, None
+    key = make_invoice_key(code, number)
+    if key is not None and key in known_invoices:
+        return 'duplicate', None, key
+    if not rows:
+        return 'parsed', None, key
+    with stage('merge_rows'):
+        df = pd.DataFrame(rows, columns=DETAIL_COLUMNS)
+        df.insert(0, '序号', range(1, len(df) + 1))
+    with stage('typed_columns'):
+        return 'parsed', typed_detail_columns(df), key
+
+
+def find_text(root, tags):
+    for element in root.iter():
+        if local_name(element.tag) in tags and element.text and element.text.strip():
+            return element.text.strip()
+    return None
+
+
+def iter_items(root):
+    """明细元素：直接子元素中同时有项目名称和金额字段的元素"""
+    name_tags = set(ITEM_FIELDS['项目名称'])
+    amount_tags = set(ITEM_FIELDS['金额'])
+    for element in root.iter():
+        children = {local_name(child.tag) for child in element}
+        if children & name_tags and children & amount_tags:
+            yield element
+
+
+def item_row(item):
+    values = {}
+    for child in item:
+        name = local_name(child.tag)
+        if name not in values:
+            values[name] = (child.text or '').strip()
+    row = {}
+    for column, tags in ITEM_FIELDS.items():
+        row[column] = next((values[tag] for tag in tags if tag in values), '')
+    row['税率/征收率'] = tax_rate_text(row['税率/征收率'])
+    return row
+
+
+def tax_rate_text(text):
+    """XML中的税率为小数（0.13），转换为发票上的写法（13%）；免税等文字原样保留"""
+    if not text or text.endswith('%'):
+        return text
+    try:
+        rate = Decimal(text)
+    except InvalidOperation:
+        return text
+    return f"{(rate * 100).normalize():f}%"
+
+
+def parse_ofd(data, known_invoices=()):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        # 全电发票的 OFD 在附件中带有原始发票XML，直接解析最准确
+        for name in zf.namelist():
+            lower = name.lower()
+            if lower.endswith('.xml') and 'attach' in lower and not lower.endswith('attachments.xml'):
+                with stage('open'):
+                    try:
+                        root = ET.fromstring(zf.read(name))
+                    except ET.ParseError:
+                        continue
+                if any(True for _ in iter_items(root)):
+                    return parse_invoice_xml(root, known_invoices)
+        with stage('extract_text'):
+            page_texts = ofd_page_texts(zf)
+    if not has_invoice_number(page_texts):
+        return 'not_invoice', None, None
+    key = invoice_key(page_texts)
+    if key is not None and key in known_invoices:
+        return 'duplicate', None, key
+    return 'parsed', extract_goods_from_texts(page_texts), key
+
+
+def ofd_page_texts(zf):
+    """按页把文字对象（含模板页）按坐标拼成文本行，返回每页一段文本；OFD.xml 中没有 DocRoot 时返回空列表"""
+    root = ET.fromstring(zf.read('OFD.xml'))
+    doc_root = next((e.text.strip() for e in root.iter() if local_name(e.tag) == 'DocRoot' and e.text), None)
+    if not doc_root:
+        return []
+    doc_path = doc_root.lstrip('/')
+    doc_dir = posixpath.dirname(doc_path)
+    document = ET.fromstring(zf.read(doc_path))
+    templates = {}
+    pages = []
+    for element in document.iter():
+        tag = local_name(element.tag)
+        if tag == 'TemplatePage':
+            templates[element.get('ID')] = element.get('BaseLoc')
+        elif tag == 'Page' and element.get('BaseLoc'):
+            pages.append(element.get('BaseLoc'))
+
+    def resolve(loc):
+        return loc.lstrip('/') if loc.startswith('/') else posixpath.normpath(posixpath.join(doc_dir, loc))
+
+    page_texts = []
+    for loc in pages:
+        page = ET.fromstring(zf.read(resolve(loc)))
+        texts = []
+        for element in page.iter():
+            if local_name(element.tag) == 'Template' and element.get('TemplateID') in templates:
+                texts.extend(ofd_text_objects(ET.fromstring(zf.read(resolve(templates[element.get('TemplateID')])))))
+        texts.extend(ofd_text_objects(page))
+        page_texts.append(ofd_lines(texts))
+    return page_texts
+
+
+def ofd_text_objects(page):
+    """页面中每段文字的 (x, y, 文字)，坐标为文字对象外框加上文字的相对位置"""
+    result = []
+    for obj in page.iter():
+        if local_name(obj.tag) != 'TextObject':
+            continue
+        box = [float(v) for v in (obj.get('Boundary') or '0 0 0 0').split()]
+        for code in obj:
+            if local_name(code.tag) == 'TextCode' and code.text and code.text.strip():
+                result.append((box[0] + float(code.get('X') or 0), box[1] + float(code.get('Y') or 0),
+                               code.text.strip()))
+    return result
+
+
+def ofd_lines(texts):
+    """基线相近的文字合并为一行，行内按横坐标排列，行之间从上到下"""
+    lines = []
+    for x, y, text in sorted(texts, key=lambda t: t[1]):
+        if lines and y - lines[-1][0] <= OFD_LINE_TOLERANCE:
+            lines[-1][1].append((x, text))
+        else:
+            lines.append((y, [(x, text)]))
+    return "\n".join(" ".join(text for _, text in sorted(parts)) for _, parts in lines)
+
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""ZIP包展开（含嵌套ZIP、包内过滤）和 ArchiveReader 的复用与关闭"""
+
+import io
+import zipfile
+import pytest
+import DigitalInvoice2EXCEL
+from DigitalInvoice2EXCEL import ArchiveMember, ArchiveReader, iter_sources
+
+
+def zip_bytes(members):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return data.getvalue()
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    inner = zip_bytes({'c.pdf': b'%PDF c', 'deep/d.XML': b'<d/>', 'skip.txt': b''})
+    path = tmp_path / 'bundle.zip'
+    path.write_bytes(zip_bytes({'a.pdf': b'%PDF a', 'nested.zip': inner, 'docs/': b'',
+                                'draft/b.pdf': b'%PDF b', 'e.ofd': b'PK'}))
+    return str(path)
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """记录打开过的 ZipFile，检查是否都已关闭"""
+    zips = []
+    real = zipfile.ZipFile
+
+    def tracking(*args, **kwargs):
+        zf = real(*args, **kwargs)
+        zips.append(zf)
+        return zf
+    monkeypatch.setattr(DigitalInvoice2EXCEL.zipfile, 'ZipFile', tracking)
+    return zips
+
+
+def member_names(sources, bundle):
+    return [s.path.replace(bundle, 'bundle.zip') if isinstance(s, ArchiveMember) else s for s in sources]
+
+
+def test_nested_archives_are_expanded_in_order(bundle):
+    sources = list(iter_sources(['x.pdf', bundle]))
+    assert member_names(sources, bundle) == [
+        'x.pdf', 'bundle.zip::a.pdf', 'bundle.zip::nested.zip::c.pdf', 'bundle.zip::nested.zip::deep/d.XML',
+        'bundle.zip::draft/b.pdf', 'bundle.zip::e.ofd']
+    assert sources[2].chain == (bundle, 'nested.zip', 'c.pdf')
+
+
+def test_include_and_exclude_apply_inside_archives(bundle):
+    sources = iter_sources([bundle], include=['*.PDF', '*.xml'], exclude=['draft/*'])
+    assert member_names(sources, bundle) == [
+        'bundle.zip::a.pdf', 'bundle.zip::nested.zip::c.pdf', 'bundle.zip::nested.zip::deep/d.XML']
+
+
+def test_nested_archive_is_not_read_ahead(bundle, opened):
+    sources = iter_sources([bundle])
+    assert next(sources).chain == (bundle, 'a.pdf')
+    # 产出第一个成员时只打开过外层压缩包的目录，嵌套ZIP尚未读取，且没有打开着的压缩包
+    assert len(opened) == 1 and all(zf.fp is None for zf in opened)
+    list(sources)
+    assert all(zf.fp is None for zf in opened)
+
+
+def test_broken_archive_is_skipped(tmp_path, bundle):
+    broken = tmp_path / 'broken.zip'
+    broken.write_bytes(b'not a zip')
+    assert member_names(iter_sources([str(broken), 'x.pdf']), bundle) == ['x.pdf']
+
+
+def test_reader_reuses_archive_for_consecutive_members_and_closes(bundle, opened):
+    members = list(iter_sources([bundle]))
+    del opened[:]
+    with ArchiveReader() as reader:
+        contents = [reader.read(member) for member in members]
+        # 按包内顺序读取：外层在进入和离开嵌套ZIP时各重新打开一次，嵌套ZIP只打开一次
+        assert len(opened) == 4
+        assert [zf.fp is None for zf in opened] == [True, True, True, False]
+    assert contents == [b'%PDF a', b'%PDF c', b'<d/>', b'%PDF b', b'PK']
+    assert all(zf.fp is None for zf in opened)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""iter_pdf_files 递归枚举和 FileDiscovery 后台枚举线程"""
+
+import itertools
+import os
+import time
+import pytest
+from DigitalInvoice2EXCEL import FileDiscovery, iter_pdf_files
+
+
+def touch(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'')
+    return str(path)
+
+
+def relative(paths, root):
+    return [os.path.relpath(p, root).replace(os.sep, '/') for p in paths]
+
+
+def test_recurses_in_name_order(tmp_path):
+    for name in ('b.pdf', 'a.pdf', 'sub/c.pdf', 'sub/deeper/d.ofd', 'notes.txt'):
+        touch(tmp_path / name)
+    assert relative(iter_pdf_files(str(tmp_path)), tmp_path) == ['a.pdf', 'b.pdf', 'sub/c.pdf', 'sub/deeper/d.ofd']
+
+
+def test_patterns_ignore_case(tmp_path):
+    for name in ('A.PDF', 'b.Pdf', 'c.xml', 'Draft_1.pdf'):
+        touch(tmp_path / name)
+    files = iter_pdf_files(str(tmp_path), include=['*.pdf'], exclude=['draft_*'])
+    assert relative(files, tmp_path) == ['A.PDF', 'b.Pdf']
+
+
+def test_excluded_folders_are_not_entered(tmp_path, monkeypatch):
+    touch(tmp_path / 'keep' / 'a.pdf')
+    touch(tmp_path / 'Archive' / 'old.pdf')
+    touch(tmp_path / 'keep' / 'archive' / 'nested.pdf')
+    scanned = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: scanned.append(path) or real_scandir(path))
+    files = iter_pdf_files(str(tmp_path), exclude=['archive', 'keep/archive'])
+    assert relative(files, tmp_path) == ['keep/a.pdf']
+    assert not any('rchive' in path for path in scanned)
+
+
+def test_symlink_loops_are_visited_once(tmp_path):
+    touch(tmp_path / 'sub' / 'a.pdf')
+    try:
+        os.symlink(str(tmp_path), str(tmp_path / 'sub' / 'loop'), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("当前系统不能创建符号链接")
+    assert relative(iter_pdf_files(str(tmp_path)), tmp_path) == ['sub/a.pdf']
+
+
+def test_discovery_yields_in_order():
+    discovery = FileDiscovery(iter(['a.pdf', 'b.pdf', 'c.pdf']))
+    assert list(discovery) == ['a.pdf', 'b.pdf', 'c.pdf']
+    assert discovery.finished and discovery.found == 3
+
+
+def test_discovery_thread_stops_when_consumer_stops():
+    produced = []
+
+    def endless():
+        for i in itertools.count():
+            produced.append(i)
+            yield f'{i}.pdf'
+
+    discovery = FileDiscovery(endless(), maxsize=5)
+    files = iter(discovery)
+    assert [next(files) for _ in range(3)] == ['0.pdf', '1.pdf', '2.pdf']
+    files.close()
+    deadline = time.monotonic() + 5
+    while not discovery.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discovery.finished
+    count = len(produced)
+    time.sleep(0.3)
+    # 队列满后枚举线程已退出，不再继续遍历
+    assert len(produced) == count <= 3 + 5 + 2
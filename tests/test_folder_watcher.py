@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""FolderWatcher 的变化检测：两次快照一致才报告、删除检测、文件夹暂时无法访问"""
+
+import os
+from DigitalInvoice2EXCEL import FolderWatcher
+
+
+def write(path, data=b'%PDF'):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_new_file_is_reported_once_stable(tmp_path):
+    watcher = FolderWatcher([str(tmp_path)])
+    a = write(tmp_path / 'a.pdf')
+    assert watcher.poll() == ([], [])
+    assert watcher.poll() == ([a], [])
+    assert watcher.poll() == ([], [])
+
+
+def test_file_still_being_written_waits_for_two_equal_snapshots(tmp_path):
+    watcher = FolderWatcher([str(tmp_path)])
+    a = write(tmp_path / 'a.pdf', b'%PDF-1')
+    assert watcher.poll() == ([], [])
+    write(tmp_path / 'a.pdf', b'%PDF-1.7 more')
+    assert watcher.poll() == ([], [])
+    assert watcher.poll() == ([a], [])
+
+
+def test_known_files_are_not_reimported(tmp_path):
+    a = write(tmp_path / 'a.pdf')
+    b = write(tmp_path / 'sub' / 'b.pdf')
+    watcher = FolderWatcher([str(tmp_path)], known_paths=[a, b + '::inner.pdf'])
+    assert watcher.poll() == ([], [])
+    assert watcher.poll() == ([], [])
+    os.remove(a)
+    assert watcher.poll() == ([], [a])
+
+
+def test_modified_file_is_reported_again(tmp_path):
+    watcher = FolderWatcher([str(tmp_path)])
+    a = write(tmp_path / 'a.pdf', b'%PDF-1')
+    watcher.poll()
+    watcher.poll()
+    write(tmp_path / 'a.pdf', b'%PDF-1.7 changed')
+    assert watcher.poll() == ([], [])
+    assert watcher.poll() == ([a], [])
+
+
+def test_unreachable_folder_keeps_its_snapshot(tmp_path):
+    inbox = tmp_path / 'inbox'
+    other = tmp_path / 'other'
+    files = [write(inbox / name) for name in ('a.pdf', 'b.pdf', 'c.pdf')]
+    d = write(other / 'd.pdf')
+    watcher = FolderWatcher([str(inbox), str(other)], known_paths=files + [d])
+    watcher.poll()
+    new = write(inbox / 'new.pdf')
+    assert watcher.poll() == ([], [])
+
+    # 网络盘断开一次轮询：该文件夹中的文件不报告为删除，其他文件夹照常比较
+    os.rename(inbox, tmp_path / 'away')
+    os.remove(d)
+    assert watcher.poll() == ([], [d])
+    os.rename(tmp_path / 'away', inbox)
+    assert watcher.poll() == ([new], [])
+    assert watcher.poll() == ([], [])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""invoice_export 的分表/分文件命名和 CSV / Parquet 导出"""
+
+import csv
+import os
+import threading
+import pandas as pd
+import pytest
+from invoice_export import ExportCancelled, export_invoices, sheet_names
+from invoice_parser import typed_detail_columns
+
+
+def details(rows):
+    df = pd.DataFrame(rows, columns=['项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率/征收率', '税额'])
+    df.insert(0, '序号', range(1, len(df) + 1))
+    return typed_detail_columns(df)
+
+
+INVOICES = [
+    ('/in/a.pdf', details([['*办公用品*签字笔', '0.5mm', '支', '10', '2.50', '25.00', '13%', '3.25'],
+                           ['*办公用品*笔记本', 'A5', '本', '1.500', '4', '6.00', '13%', '']]), 'a.pdf'),
+    ('bundle.zip::b.xml', details([['*钢材*螺纹钢', '', '吨', '1,000', '3,250.5', '3250500.00', '13%', '422565.00']]),
+     'bundle.zip::b.xml'),
+]
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_sheet_names_use_archive_member_file_name():
+    invoices = [('bundle.zip::invoice_a.pdf', None, 'bundle.zip::invoice_a.pdf'),
+                ('a.zip::nested.zip::deep/b.pdf', None, 'a.zip::nested.zip::b.pdf'),
+                ('发票.pdf', None, '发票.pdf')]
+    assert list(sheet_names(invoices)) == ['发票1_invoice_a', '发票2_b', '发票3_发票']
+
+
+def test_csv_merge_round_trip(tmp_path):
+    path = str(tmp_path / '明细.csv')
+    assert export_invoices(path, INVOICES, 'merge', 'csv') == path
+    with open(path, 'rb') as f:
+        assert f.read(3) == b'\xef\xbb\xbf'
+    rows = read_csv(path)
+    assert rows[0] == ['序号', '来源文件', '项目名称', '规格型号', '单位', '数量', '单价', '金额', '税率/征收率', '税额']
+    # 序号跨发票连续，数值按原文的小数位数写出，空值为空
+    assert rows[1:] == [
+        ['1', 'a.pdf', '*办公用品*签字笔', '0.5mm', '支', '10', '2.50', '25.00', '13%', '3.25'],
+        ['2', 'a.pdf', '*办公用品*笔记本', 'A5', '本', '1.500', '4', '6.00', '13%', ''],
+        ['3', 'bundle.zip::b.xml', '*钢材*螺纹钢', '', '吨', '1000', '3250.5', '3250500.00', '13%', '422565.00'],
+    ]
+
+
+def test_csv_separate_writes_one_file_per_invoice(tmp_path):
+    folder = export_invoices(str(tmp_path / '明细.csv'), INVOICES, 'separate', 'csv')
+    assert folder == str(tmp_path / '明细')
+    assert sorted(os.listdir(folder)) == ['发票1_a.csv', '发票2_b.csv']
+    rows = read_csv(os.path.join(folder, '发票2_b.csv'))
+    assert '来源文件' not in rows[0] and rows[1][0] == '1'
+
+
+def test_cancelled_separate_export_removes_its_folder(tmp_path):
+    cancel = threading.Event()
+
+    def progress(done, total, name):
+        cancel.set()
+
+    with pytest.raises(ExportCancelled):
+        export_invoices(str(tmp_path / '明细.csv'), INVOICES, 'separate', 'csv', progress, cancel)
+    assert os.listdir(tmp_path) == []
+
+
+def test_cancelled_merge_export_removes_its_file(tmp_path):
+    cancel = threading.Event()
+    with pytest.raises(ExportCancelled):
+        export_invoices(str(tmp_path / '明细.csv'), INVOICES, 'merge', 'csv', lambda *args: cancel.set(), cancel)
+    assert os.listdir(tmp_path) == []
+
+
+def test_parquet_merge_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    path = export_invoices(str(tmp_path / '明细.parquet'), INVOICES, 'merge', 'parquet')
+    df = pd.read_parquet(path)
+    assert list(df.columns) == ['序号', '来源文件', '项目名称', '规格型号', '单位', '数量', '单价', '金额',
+                                '税率/征收率', '税额']
+    assert df['序号'].dtype == 'int64' and df['金额'].dtype == 'float64'
+    assert df['来源文件'].tolist() == ['a.pdf', 'a.pdf', 'bundle.zip::b.xml']
+    assert df['数量'].tolist() == [10.0, 1.5, 1000.0]
+    assert df['税额'].isna().tolist() == [False, True, False]
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""invoice_parser 的回归测试：tests/data 中是从电子发票PDF提取的文本，页之间以换页符分隔"""
+
+import glob
+import io
+import os
+import zipfile
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+import invoice_parser
+from invoice_parser import (
+    DECIMALS_SUFFIX, DETAIL_COLUMNS, find_goods_section_smart, invoice_key, is_total_line, merge_continued_rows,
+    merge_continued_rows_loop, merge_continued_rows_vectorized, parse_goods_line_corrected, typed_detail_columns,
+)
+from invoice_structured import parse_structured_source
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+INVOICE_TEXTS = sorted(glob.glob(os.path.join(DATA_DIR, 'invoice_*.txt')))
+
+
+def read_page_texts(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read().split('\f')
+
+
+def goods_frame(page_texts):
+    """与 extract_goods_from_texts 相同的步骤得到合并续行之前的明细表"""
+    rows = []
+    for text in page_texts:
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        rows.extend(parse_goods_line_corrected(line) for line in find_goods_section_smart(lines)
+                    if not is_total_line(line))
+    return pd.DataFrame(rows)[DETAIL_COLUMNS]
+
+
+def merge_continued_rows_reference(df):
+    """改为按列计算之前的逐行实现，作为合并结果的基准"""
+    if df.empty:
+        return df
+
+    key_cols = ['单位', '数量', '单价', '金额']
+    has_key = df[key_cols].notna() & (df[key_cols] != '')
+    is_complete = has_key.any(axis=1)
+
+    merged_rows = []
+    current_row = None
+
+    for idx, row in df.iterrows():
+        name_text = str(row['项目名称']).strip()
+        model_text = str(row['规格型号']).strip()
+
+        if is_complete[idx]:
+            if current_row is not None:
+                merged_rows.append(current_row)
+            current_row = row.copy()
+        else:
+            if current_row is None:
+                current_row = row.copy()
+            else:
+                append_text = (name_text + " " + model_text).strip()
+                if append_text:
+                    if current_row['规格型号']:
+                        current_row['规格型号'] += " " + append_text
+                    else:
+                        current_row['规格型号'] = append_text
+
+    if current_row is not None:
+        merged_rows.append(current_row)
+
+    return pd.DataFrame(merged_rows).reset_index(drop=True)
+
+
+def test_invoice_texts_present():
+    assert INVOICE_TEXTS
+
+
+@pytest.mark.parametrize('path', INVOICE_TEXTS, ids=os.path.basename)
+@pytest.mark.parametrize('merge', [merge_continued_rows, merge_continued_rows_loop, merge_continued_rows_vectorized])
+def test_merge_continued_rows_matches_reference(path, merge):
+    df = goods_frame(read_page_texts(path))
+    assert (df[['单位', '数量', '单价', '金额']] == '').all(axis=1).any(), "样本中应当有续行"
+    assert_frame_equal(merge(df.copy()), merge_continued_rows_reference(df.copy()))
+
+
+def test_merge_continued_rows_large_invoice_uses_vectorized_path(monkeypatch):
+    """超过阈值的明细走按列计算的分支，结果仍与逐行实现相同"""
+    df = pd.concat([goods_frame(read_page_texts(path)) for path in INVOICE_TEXTS], ignore_index=True)
+    monkeypatch.setattr(invoice_parser, 'MERGE_VECTORIZE_MIN_ROWS', len(df))
+    called = []
+    monkeypatch.setattr(invoice_parser, 'merge_continued_rows_vectorized',
+                        lambda frame: called.append(True) or merge_continued_rows_vectorized(frame))
+    assert_frame_equal(invoice_parser.merge_continued_rows(df.copy()), merge_continued_rows_reference(df.copy()))
+    assert called
+
+
+def test_invoice_key_full_digital_number():
+    assert invoice_key(read_page_texts(os.path.join(DATA_DIR, 'invoice_long.txt'))) == ':24070000000000000000'
+
+
+def test_invoice_key_old_invoices_with_same_number_and_different_codes():
+    first = "增值税电子普通发票 发票代码：044001900111 发票号码：12345678"
+    second = "增值税电子普通发票 发票代码：044001900222 发票号码：12345678"
+    assert invoice_key([first]) == "044001900111:12345678"
+    assert invoice_key([second]) == "044001900222:12345678"
+
+
+def test_invoice_key_requires_trustworthy_identity():
+    # 没有发票代码的短号码、订单号/合同号都不能作为发票键，两张不同的发票不能因此被当作重复
+    assert invoice_key(["电子发票 发票号码：12345678 开票日期：2024年05月06日"]) is None
+    assert invoice_key(["订单 No. 12345678901234567890 合同NO:88888888"]) is None
+    assert invoice_key(["发票号码：123456789012345678901"]) is None
+
+
+def test_xml_invoice_key_requires_code_for_short_number():
+    xml = """<EInvoice><InvoiceCode>{code}</InvoiceCode><InvoiceNumber>12345678</InvoiceNumber>
+    <Item><ItemName>*办公用品*签字笔</ItemName><Amount>2.50</Amount></Item></EInvoice>"""
+    keys = [parse_structured_source(xml.format(code=code).encode('utf-8'), 'xml')[2]
+            for code in ('044001900111', '044001900222', '')]
+    assert keys == ['044001900111:12345678', '044001900222:12345678', None]
+
+
+def test_ofd_without_doc_root_is_not_invoice():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zf:
+        zf.writestr('OFD.xml', '<ofd:OFD xmlns:ofd="http://www.ofdspec.org/2016"><ofd:DocBody/></ofd:OFD>')
+    assert parse_structured_source(data.getvalue(), 'ofd') == ('not_invoice', None, None)
+
+
+def test_xml_numbers_with_thousands_separators():
+    xml = """<EInvoice><InvoiceNumber>24070000000000000001</InvoiceNumber>
+    <Item><ItemName>*钢材*螺纹钢</ItemName><Quantity>1,000</Quantity><UnPrice>3,250.50</UnPrice>
+    <Amount>3,250,500.00</Amount><TaxRate>0.13</TaxRate><ComTaxAm>422,565.00</ComTaxAm></Item></EInvoice>"""
+    status, df, _ = parse_structured_source(xml.encode('utf-8'), 'xml')
+    assert status == 'parsed'
+    assert df[['数量', '单价', '金额', '税额']].iloc[0].tolist() == [1000.0, 3250.5, 3250500.0, 422565.0]
+    assert df['单价' + DECIMALS_SUFFIX].iloc[0] == 2 and df['数量' + DECIMALS_SUFFIX].iloc[0] == 0
+
+
+def test_typed_detail_columns_keeps_unparseable_text():
+    df = pd.DataFrame({'项目名称': ['a', 'b'], '数量': ['2', '详见清单'], '金额': ['10.50', '']})
+    typed = typed_detail_columns(df)
+    # 有无法转换的文本时该列保留原文，不丢失为 NaN
+    assert typed['数量'].tolist() == ['2', '详见清单']
+    assert '数量' + DECIMALS_SUFFIX not in typed.columns
+    assert typed['金额'].iloc[0] == 10.5 and typed['金额' + DECIMALS_SUFFIX].tolist() == [2, -1]
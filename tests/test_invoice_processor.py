@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""InvoiceProcessor 的重复发票判断"""
+
+import pandas as pd
+from DigitalInvoice2EXCEL import InvoiceProcessor
+from invoice_parser import invoice_key
+
+DETAILS = pd.DataFrame({'序号': [1], '项目名称': ['*办公用品*签字笔'], '金额': [2.5]})
+
+
+def check(texts, known_keys, exported_keys=()):
+    return InvoiceProcessor.check_invoice_key('parsed', DETAILS, invoice_key(texts), known_keys, set(exported_keys))
+
+
+def test_same_short_number_with_different_codes_is_not_duplicate():
+    known_keys = set()
+    first = check(["发票代码：044001900111 发票号码：12345678"], known_keys)
+    second = check(["发票代码：044001900222 发票号码：12345678"], known_keys)
+    assert first[0] == second[0] == 'parsed'
+    assert second[1] is DETAILS
+
+
+def test_short_number_without_code_is_never_rejected():
+    known_keys = set()
+    texts = ["发票号码：12345678 订单 No. 87654321"]
+    assert check(texts, known_keys)[0] == 'parsed'
+    assert check(texts, known_keys, {':12345678'})[0] == 'parsed'
+
+
+def test_full_digital_number_is_rejected_again():
+    known_keys = set()
+    texts = ["电子发票（普通发票） 发票号码：24442000000123456789"]
+    assert check(texts, known_keys)[0] == 'parsed'
+    assert check(texts, known_keys)[0] == 'duplicate'
+    assert check(texts, set(), {':24442000000123456789'})[0] == 'exported'
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""ParseCache 的命中、按最久未使用淘汰、容量统计和清空"""
+
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+import DigitalInvoice2EXCEL
+from DigitalInvoice2EXCEL import ParseCache, frame_to_json
+
+DETAILS = pd.DataFrame({'序号': [1], '项目名称': ['*办公用品*签字笔'], '金额': [2.5]})
+ENTRY_SIZE = len(frame_to_json(DETAILS).encode('utf-8'))
+
+
+@pytest.fixture
+def make_cache(tmp_path, monkeypatch):
+    clock = iter(range(1, 1000))
+    # last_used 用递增的假时间，淘汰顺序不受系统时钟精度影响
+    monkeypatch.setattr(DigitalInvoice2EXCEL, 'time', SimpleNamespace(time=lambda: next(clock)))
+    caches = []
+
+    def make(max_entries):
+        cache = ParseCache(str(tmp_path / 'cache.db'), max_entries * ENTRY_SIZE)
+        caches.append(cache)
+        return cache
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def stored_keys(cache):
+    return {key for key, in cache.conn.execute('SELECT key FROM parse_cache')}
+
+
+def test_get_returns_stored_result(make_cache):
+    cache = make_cache(10)
+    cache.put('a', 'parsed', DETAILS, ':24442000000123456789')
+    cache.put('b', 'not_invoice', None)
+    status, df, key = cache.get('a')
+    assert (status, key) == ('parsed', ':24442000000123456789')
+    pd.testing.assert_frame_equal(df, DETAILS)
+    assert cache.get('b') == ('not_invoice', None, None)
+    assert cache.get('missing') is None
+
+
+def test_evicts_least_recently_used_in_one_batch(make_cache):
+    cache = make_cache(10)
+    for name in 'abcdefghij':
+        cache.put(name, 'parsed', DETAILS)
+    cache.get('a')
+    cache.get('b')
+    assert cache.total == 10 * ENTRY_SIZE
+    cache.put('k', 'parsed', DETAILS)
+    # 超出容量时降到 90% 以下：最久未使用的 c、d 被淘汰，刚读过的 a、b 保留
+    assert stored_keys(cache) == set('abefghijk')
+    assert cache.total == cache.used_bytes() == 9 * ENTRY_SIZE
+    cache.put('l', 'parsed', DETAILS)
+    assert stored_keys(cache) == set('abefghijkl')
+
+
+def test_replacing_an_entry_does_not_double_count(make_cache):
+    cache = make_cache(10)
+    cache.put('a', 'parsed', DETAILS)
+    cache.put('a', 'parsed', DETAILS)
+    cache.put('b', 'not_invoice', None)
+    assert cache.total == cache.used_bytes() == ENTRY_SIZE
+
+
+def test_total_is_loaded_when_opened(make_cache):
+    cache = make_cache(10)
+    for name in 'abc':
+        cache.put(name, 'parsed', DETAILS)
+    cache.close()
+    assert make_cache(10).total == 3 * ENTRY_SIZE
+
+
+def test_clear_removes_everything(make_cache):
+    cache = make_cache(10)
+    for name in 'abc':
+        cache.put(name, 'parsed', DETAILS)
+    assert cache.clear() == 3
+    assert cache.get('a') is None
+    assert cache.total == cache.used_bytes() == 0